@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+import env  # noqa: F401  (loads .env when run as a script)
+from db import mongodb
+from retention import shortest_retention_days
+from scan_store import risk_level_of
+from usage import _day, _field
+
+
+# Dashboard rollups in `analytics_daily`. Every scan $inc-s three bucket
+# documents for its day: the global bucket ("all"), its user's bucket and its
+# provider's bucket. Reads touch one document per bucket, never `scans`.
+# Provider failures produce no scan document, so their counters (`failed`,
+# `failed_by_provider`) can only be recorded live; a rebuild keeps them.
+DIMENSIONS = ("all", "user", "provider")
+FAILURE_FIELDS = ("failed", "failed_by_provider")
+# Counters a rebuild recomputes from `scans`
+SCAN_COUNTS = ("scans", "images", "reused", "invalid", "reasked")
+SCAN_BREAKDOWNS = ("risk", "by_provider", "by_model", "by_question", "by_survey_level")
+
+
+def _rollups():
+    return mongodb.db["analytics_daily"]
+
+
+def _bucket_id(bucket: Dict[str, Any]) -> str:
+    if bucket["dim"] == "all":
+        return f"{bucket['day']}|all"
+    return f"{bucket['day']}|{bucket['dim']}|{bucket['key']}"
+
+
+def _buckets(day: str, user_id: Optional[ObjectId], provider: str) -> List[Dict[str, Any]]:
+    return [
+        {"day": day, "dim": "all", "key": None},
+        {"day": day, "dim": "user", "key": user_id},
+        {"day": day, "dim": "provider", "key": provider},
+    ]
+
+
+def scan_counters(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """$inc document describing one scan (full document or `scans` summary)."""
+    risk = doc.get("risk_level") or risk_level_of(doc.get("structured")) or "unknown"
+    validation = doc.get("validation") or {}
+    inc: Dict[str, Any] = {
+        "scans": 1,
+        "images": int(doc.get("images_count") or 0),
+        "reused": 1 if doc.get("reused") or doc.get("reused_from") else 0,
+        "invalid": 0 if validation.get("ok", True) else 1,
+        "reasked": 1 if validation.get("reasked") else 0,
+        f"risk.{_field(risk)}": 1,
+        f"by_provider.{_field(doc.get('provider') or 'unknown')}": 1,
+        f"by_model.{_field(doc.get('model') or 'unknown')}": 1,
+        f"by_question.{_field(doc.get('question_id') or 'unknown')}": 1,
+    }
+    level = (doc.get("survey") or {}).get("level")
+    if level is not None:
+        inc[f"by_survey_level.{_field(level)}"] = 1
+    return inc
+
+
+async def record_scan(doc: Dict[str, Any]) -> None:
+    now = datetime.utcnow()
+    day = _day(doc.get("created_at") or now)
+    inc = scan_counters(doc)
+    ops = [
+        UpdateOne({"_id": _bucket_id(b)}, {"$inc": inc, "$setOnInsert": b, "$set": {"updated_at": now}}, upsert=True)
+        for b in _buckets(day, doc.get("user_id"), doc.get("provider") or "unknown")
+    ]
+    await _rollups().bulk_write(ops, ordered=False)
+
+
+async def record_failure(user_id: Optional[ObjectId], provider: str) -> None:
+    now = datetime.utcnow()
+    inc = {"failed": 1, f"failed_by_provider.{_field(provider or 'unknown')}": 1}
+    ops = [
+        UpdateOne({"_id": _bucket_id(b)}, {"$inc": inc, "$setOnInsert": b, "$set": {"updated_at": now}}, upsert=True)
+        for b in _buckets(_day(now), user_id, provider or "unknown")
+    ]
+    await _rollups().bulk_write(ops, ordered=False)
+
+
+def _add(target: Dict[str, Any], inc: Dict[str, Any]) -> None:
+    for path, value in inc.items():
+        node = target
+        *parents, leaf = path.split(".")
+        for p in parents:
+            node = node.setdefault(p, {})
+        node[leaf] = node.get(leaf, 0) + value
+
+
+async def rebuild(days: Optional[int] = None, batch_size: int = 500) -> Dict[str, int]:
+    """Recompute scan-derived rollups from `scans` (the last ``days`` days, or all history).
+
+    The window is capped at the shortest scan retention, since older days have
+    lost scans to the TTL index and their live counts are the better record.
+    Current bucket counters are read first, then scans created before the
+    rebuild started are counted, and each bucket gets an ``$inc`` of the
+    difference. Live ``$inc``s for scans arriving during the rebuild are kept,
+    failure counters are untouched and buckets already correct are not written.
+    """
+    retained = shortest_retention_days()
+    if retained:
+        days = min(days, retained) if days else retained
+    started = datetime.utcnow()
+    since = _day(started - timedelta(days=days - 1)) if days else None
+    day_filter: Dict[str, Any] = {"day": {"$gte": since}} if since else {}
+
+    fields = SCAN_COUNTS + SCAN_BREAKDOWNS
+    deltas: Dict[str, Dict[str, Any]] = defaultdict(dict)
+    async for d in _rollups().find(day_filter, {f: 1 for f in fields}):
+        deltas[d["_id"]] = {path: -value for path, value in _flatten(d) if path.split(".", 1)[0] in fields}
+
+    meta: Dict[str, Dict[str, Any]] = {}
+    scan_filter: Dict[str, Any] = {"created_at": {"$lt": started}}
+    if since:
+        scan_filter["created_at"]["$gte"] = datetime.strptime(since, "%Y-%m-%d")
+    projection = {
+        "user_id": 1, "provider": 1, "model": 1, "question_id": 1, "created_at": 1, "images_count": 1,
+        "risk_level": 1, "validation.ok": 1, "validation.reasked": 1, "reused": 1, "reused_from": 1, "survey.level": 1,
+    }
+    scanned = 0
+    async for doc in mongodb.db["scans"].find(scan_filter, projection, batch_size=batch_size):
+        day = _day(doc.get("created_at") or started)
+        inc = scan_counters(doc)
+        for b in _buckets(day, doc.get("user_id"), doc.get("provider") or "unknown"):
+            bucket_id = _bucket_id(b)
+            meta[bucket_id] = b
+            delta = deltas[bucket_id]
+            for path, value in inc.items():
+                delta[path] = delta.get(path, 0) + value
+        scanned += 1
+
+    now = datetime.utcnow()
+    ops = []
+    for bucket_id, delta in deltas.items():
+        delta = {path: value for path, value in delta.items() if value}
+        if not delta:
+            continue
+        update: Dict[str, Any] = {"$inc": delta, "$set": {"updated_at": now}}
+        if bucket_id in meta:
+            update["$setOnInsert"] = meta[bucket_id]
+        ops.append(UpdateOne({"_id": bucket_id}, update, upsert=bucket_id in meta))
+    for i in range(0, len(ops), batch_size):
+        await _rollups().bulk_write(ops[i:i + batch_size], ordered=False)
+    return {"scans": scanned, "buckets": len(ops), "days": days or 0}
+
+
+def _failure_rate(counts: Dict[str, Any]) -> float:
+    attempts = counts.get("scans", 0) + counts.get("failed", 0)
+    return round(counts.get("failed", 0) / attempts, 4) if attempts else 0.0
+
+
+async def dashboard(days: int = 30, dim: str = "all", key: Optional[str] = None) -> Dict[str, Any]:
+    """Per-day buckets for one dimension plus totals over the window."""
+    since = _day(datetime.utcnow() - timedelta(days=max(days, 1) - 1))
+    flt: Dict[str, Any] = {"day": {"$gte": since}, "dim": dim}
+    if key is not None:
+        flt["key"] = ObjectId(key) if dim == "user" and ObjectId.is_valid(key) else key
+    rows = await _rollups().find(flt, {"updated_at": 0}).sort("day", 1).limit(5000).to_list(length=None)
+
+    totals: Dict[str, Any] = {}
+    for row in rows:
+        row["failure_rate"] = _failure_rate(row)
+        _add(totals, {
+            path: value
+            for path, value in _flatten(row)
+            if path not in ("_id", "day", "dim", "key", "failure_rate")
+        })
+    totals["failure_rate"] = _failure_rate(totals)
+    return {"since": since, "dim": dim, "key": key, "days": rows, "totals": totals}
+
+
+def _flatten(doc: Dict[str, Any], prefix: str = ""):
+    for k, v in doc.items():
+        path = f"{prefix}{k}"
+        if isinstance(v, dict):
+            yield from _flatten(v, f"{path}.")
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield path, v
+
+
+async def _main(argv: List[str]) -> None:
+    await mongodb.connect()
+    try:
+        days = int(argv[1]) if argv[:1] == ["--days"] and len(argv) > 1 else None
+        print(await rebuild(days))
+    finally:
+        await mongodb.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
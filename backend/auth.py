@@ -1,42 +1,52 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import logging
 import os
+import time
+from collections import Counter
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional
 import secrets
 from urllib.parse import urlencode
 
-import bcrypt
 import jwt
 from bson import ObjectId
 from fastapi import APIRouter, Header, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import RedirectResponse
 
+import env  # noqa: F401
+from cache import MemoryLRU, register
 from db import mongodb
+from responses import ORJSONResponse
 from models import LoginRequest, SignupRequest, TokenResponse, UserPublic, BasicOK
 from pymongo.errors import DuplicateKeyError
 
-
-try:
-    from dotenv import load_dotenv  # type: ignore
-    load_dotenv()
-except Exception:
-    # dotenv not installed or failed to load; proceed without .env support
-    pass
-
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALG = "HS256"
 JWT_EXP_DAYS = int(os.getenv("JWT_EXP_DAYS", "7"))
 SEED_ADMIN_SECRET = os.getenv("SEED_ADMIN_SECRET")
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+AUTH_REVOCATION_REFRESH_SECONDS = float(os.getenv("AUTH_REVOCATION_REFRESH_SECONDS", "10"))
+# Lifetime of the single-purpose tokens put in download URLs (?token=)
+DOWNLOAD_TOKEN_TTL_SECONDS = int(os.getenv("DOWNLOAD_TOKEN_TTL_SECONDS", "300"))
+
+log = logging.getLogger("auth")
 
 
+# bcrypt is only needed for password signup/login, so it is imported on first use
 def _hash_password(pw: str) -> str:
+    import bcrypt
+
     return bcrypt.hashpw(pw.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 
 def _verify_password(pw: str, hashed: str) -> bool:
+    import bcrypt
+
     try:
         return bcrypt.checkpw(pw.encode("utf-8"), hashed.encode("utf-8"))
     except Exception:
@@ -59,14 +69,159 @@ def _decode_token(token: str) -> Dict[str, Any]:
     return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
 
 
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    pass
+
+
+class VerifiedTokens:
+    """Claims of recently verified tokens, keyed by token digest.
+
+    Entries expire at the token's own ``exp``, so a cached token is never
+    accepted past the point where ``jwt.decode`` would reject it. Revoked
+    digests (from `revoked_tokens`, loaded incrementally every
+    AUTH_REVOCATION_REFRESH_SECONDS) are checked before the cache.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self._lru = MemoryLRU(max_entries)
+        self.revoked: Dict[str, float] = {}
+        self.stats: Counter = Counter()
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        digest = token_digest(token)
+        if digest in self.revoked:
+            self.stats["revoked"] += 1
+            raise TokenRevoked("Token revoked")
+        claims = self._lru.get_nowait(digest, None)
+        if claims is not None:
+            self.stats["hits"] += 1
+            return dict(claims)
+        self.stats["misses"] += 1
+        claims = _decode_token(token)
+        ttl = float(claims.get("exp") or 0) - time.time()
+        if ttl > 0:
+            self._lru.set_nowait(digest, claims, ttl)
+        return dict(claims)
+
+    def revoke(self, digest: str, exp: float) -> None:
+        self.revoked[digest] = exp
+        self._lru.delete_nowait(digest)
+
+    def merge_revoked(self, entries: Dict[str, float]) -> None:
+        now = time.time()
+        for digest, exp in entries.items():
+            self.revoke(digest, exp)
+        self.revoked = {d: exp for d, exp in self.revoked.items() if exp > now}
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self._lru),
+            "revoked_tokens": len(self.revoked),
+        }
+
+
+verified_tokens = VerifiedTokens(AUTH_TOKEN_CACHE_SIZE)
+register("auth_tokens", verified_tokens)
+
+
+def _verify(token: str) -> Dict[str, Any]:
+    try:
+        return verified_tokens.verify(token)
+    except TokenRevoked:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
 def parse_authorization(authorization: Optional[str]) -> Dict[str, Any]:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
-    token = authorization.split(" ", 1)[1]
-    try:
-        return _decode_token(token)
-    except jwt.PyJWTError:
+    claims = _verify(authorization.split(" ", 1)[1])
+    if claims.get("purpose"):
+        # Download tokens are only good for the one URL they were issued for
         raise HTTPException(status_code=401, detail="Invalid token")
+    return claims
+
+
+def create_download_token(authorization: Optional[str], purpose: str) -> Dict[str, Any]:
+    """Short-lived token for ``purpose`` only, safe to put in a URL instead of the session token.
+
+    It dies with the session: logging out revokes it too.
+    """
+    claims = parse_authorization(authorization)
+    now = datetime.now(tz=timezone.utc)
+    payload = {
+        "sub": claims.get("sub"),
+        "purpose": purpose,
+        "sid": token_digest(authorization.split(" ", 1)[1]),
+        "iat": int(now.timestamp()),
+        "exp": int((now + timedelta(seconds=DOWNLOAD_TOKEN_TTL_SECONDS)).timestamp()),
+    }
+    return {"token": jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG), "expires_in": DOWNLOAD_TOKEN_TTL_SECONDS}
+
+
+def parse_download_token(token: str, purpose: str) -> Dict[str, Any]:
+    claims = _verify(token)
+    if claims.get("purpose") != purpose:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if claims.get("sid") in verified_tokens.revoked:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return claims
+
+
+def _revoked():
+    return mongodb.db["revoked_tokens"]
+
+
+async def revoke_token(token: str, claims: Dict[str, Any]) -> None:
+    digest = token_digest(token)
+    exp = float(claims.get("exp") or time.time() + JWT_EXP_DAYS * 86400)
+    await _revoked().update_one(
+        {"_id": digest},
+        {"$set": {"user_id": claims.get("sub"), "expire_at": datetime.utcfromtimestamp(exp), "revoked_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    verified_tokens.revoke(digest, exp)
+
+
+# Start of the last successful load; later loads only fetch tokens revoked since,
+# re-reading a short overlap to cover clock skew between replicas and late commits.
+_revocations_seen: Optional[datetime] = None
+_REVOCATION_OVERLAP = timedelta(seconds=60)
+
+
+async def load_revocations() -> int:
+    global _revocations_seen
+    now = datetime.utcnow()
+    query: Dict[str, Any] = {"expire_at": {"$gt": now}}
+    if _revocations_seen is not None:
+        query["revoked_at"] = {"$gt": _revocations_seen - _REVOCATION_OVERLAP}
+    entries: Dict[str, float] = {}
+    async for doc in _revoked().find(query, {"expire_at": 1}):
+        entries[doc["_id"]] = doc["expire_at"].replace(tzinfo=timezone.utc).timestamp()
+    # merge_revoked also drops digests whose token has expired
+    verified_tokens.merge_revoked(entries)
+    _revocations_seen = now
+    return len(entries)
+
+
+async def sync_revocations_forever(interval: float = AUTH_REVOCATION_REFRESH_SECONDS) -> None:
+    """Pick up tokens revoked by other workers/replicas."""
+    while True:
+        try:
+            await load_revocations()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("loading revoked tokens failed: %s", e)
+        await asyncio.sleep(interval)
 
 
 def _users():
@@ -198,15 +353,16 @@ async def login(body: LoginRequest):
 
 
 @router.get("/me")
-async def me(authorization: Optional[str] = Header(default=None)) -> JSONResponse:
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing bearer token")
-    token = authorization.split(" ", 1)[1]
-    try:
-        claims = _decode_token(token)
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return JSONResponse({"ok": True, "claims": claims})
+async def me(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    return ORJSONResponse({"ok": True, "claims": claims})
+
+
+@router.post("/logout")
+async def logout(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    await revoke_token(authorization.split(" ", 1)[1], claims)
+    return ORJSONResponse({"ok": True})
 
 
 # ------------------ Google OAuth 2.0 ------------------
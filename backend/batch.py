@@ -0,0 +1,356 @@
+"""Offline batch analyzer for directories (or manifests) of survey photos.
+
+Usage:
+    python batch.py PATH [--manifest FILE] [--question-id rics_single_image]
+                         [--provider ollama] [--model llava:7b]
+                         [--output mongo | --output results.jsonl]
+                         [--state batch_state.json] [--concurrency 4] [--workers N]
+
+Images are read, hashed and optionally downscaled in a process pool that runs
+ahead of the provider calls and feeds a bounded queue; ``--concurrency`` limits
+only the provider calls. Provider, extraction and persistence code are those of
+the API. Progress is checkpointed to the state file after every image so an
+interrupted run picks up where it stopped. Scan ids are derived from the run's
+batch id, the image path and its sha256, so images that reached Mongo (or the
+JSONL output) before a crash are not analysed or written twice.
+Scans get ``expire_at`` from the retention policy of ``--user-id``'s role.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from db import mongodb
+from main import _extract_structured_json, call_provider
+from phash import dhash, to_hex
+from prompts import QUESTIONS, resolve_prompt
+from responses import dumps
+from retention import expiry_for
+from scan_store import insert_scan
+from storage import ALLOWED_EXTS, store_image
+from analytics import record_scan
+from usage import record_usage
+from validation import validate_structured
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:
+    Image = None  # type: ignore
+
+
+def _iter_items(root: Optional[str], manifest: Optional[str]) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]] = []
+    if manifest:
+        with open(manifest, "r", encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                # Either a bare path per line or a JSON object with "path" and optional property fields
+                item = json.loads(line) if line.startswith("{") else {"path": line}
+                item["path"] = str(Path(item["path"]).resolve())
+                items.append(item)
+    if root:
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if os.path.splitext(name)[1].lower() in ALLOWED_EXTS:
+                    items.append({"path": str(Path(dirpath, name).resolve())})
+    return items
+
+
+def _preprocess(path: str, max_side: int) -> Dict[str, Any]:
+    # Runs in a worker process
+    contents = Path(path).read_bytes()
+    if max_side and Image is not None:
+        try:
+            with Image.open(io.BytesIO(contents)) as im:
+                if max(im.size) > max_side:
+                    im.thumbnail((max_side, max_side))
+                    out = io.BytesIO()
+                    im.convert("RGB").save(out, "JPEG", quality=88)
+                    contents = out.getvalue()
+        except Exception:
+            pass
+    ph = dhash(contents)
+    return {
+        "contents": contents,
+        "sha256": hashlib.sha256(contents).hexdigest(),
+        "phash": to_hex(ph) if ph is not None else None,
+    }
+
+
+def _open_jsonl(path: str) -> Tuple[Any, Set[str]]:
+    """Open the JSONL output for appending and return the scan ids already in it.
+
+    A torn final line from a crash is cut off so the next record starts on a
+    fresh line; its image is not in the set and is written again.
+    """
+    written: Set[str] = set()
+    fh = open(path, "a+b")
+    fh.seek(0)
+    good = 0
+    for line in fh:
+        if not line.endswith(b"\n"):
+            break
+        try:
+            written.add(json.loads(line)["_id"])
+        except (ValueError, KeyError, TypeError):
+            pass
+        good += len(line)
+    fh.truncate(good)
+    return fh, written
+
+
+class BatchState:
+    """Checkpoint journal: one JSON line per finished item, appended as it finishes.
+
+    The first line holds the run's ``batch_id``, from which scan ids are
+    derived, so a resumed run writes the same ids and never duplicates a scan.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.done: Dict[str, Dict[str, Any]] = {}
+        self.batch_id: Optional[str] = None
+        if path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    continue
+                if "batch_id" in entry:
+                    self.batch_id = entry["batch_id"]
+                elif "done" in entry:
+                    # Single-document format of earlier versions
+                    self.done.update(entry["done"])
+                elif "path" in entry:
+                    self.done[entry.pop("path")] = entry
+        if self.batch_id is None:
+            self.batch_id = str(ObjectId())
+            self.save()
+        self._fh = path.open("a", encoding="utf-8")
+
+    def finished(self, path: str, retry_failed: bool) -> bool:
+        entry = self.done.get(path)
+        if not entry:
+            return False
+        return entry.get("status") == "ok" or not retry_failed
+
+    def record(self, path: str, entry: Dict[str, Any]) -> None:
+        self.done[path] = entry
+        self._fh.write(json.dumps({"path": path, **entry}) + "\n")
+        self._fh.flush()
+
+    def scan_id(self, path: str, sha256: str) -> ObjectId:
+        """Stable scan id for an image of this run: batch timestamp + hash of path and content."""
+        digest = hashlib.sha256(f"{self.batch_id}|{path}|{sha256}".encode("utf-8")).digest()
+        return ObjectId(ObjectId(self.batch_id).binary[:4] + digest[:8])
+
+    def save(self) -> None:
+        """Rewrite the journal compactly (one line per item)."""
+        if getattr(self, "_fh", None):
+            self._fh.close()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            fh.write(json.dumps({"batch_id": self.batch_id}) + "\n")
+            for path, entry in self.done.items():
+                fh.write(json.dumps({"path": path, **entry}) + "\n")
+        os.replace(tmp, self.path)
+        self._fh = self.path.open("a", encoding="utf-8")
+
+    def close(self) -> None:
+        self.save()
+        self._fh.close()
+
+
+class Progress:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._last = 0.0
+
+    def tick(self, ok: bool) -> None:
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self._last >= 2 or self.done == self.total:
+            self._last = now
+            elapsed = now - self.started
+            rate = self.done / elapsed if elapsed else 0.0
+            eta = (self.total - self.done) / rate if rate else float("inf")
+            print(
+                f"[{self.done}/{self.total}] {rate:.2f} img/s, failed {self.failed}, ETA {eta:.0f}s",
+                file=sys.stderr,
+            )
+
+
+async def run(args: argparse.Namespace) -> int:
+    items = _iter_items(args.path, args.manifest)
+    state = BatchState(Path(args.state))
+    todo = [it for it in items if not state.finished(it["path"], args.retry_failed)]
+    print(f"{len(items)} image(s), {len(items) - len(todo)} already done, {len(todo)} to process", file=sys.stderr)
+    if not todo:
+        state.close()
+        return 0
+
+    prompt, schema = resolve_prompt(args.question_id, args.provider)
+    to_mongo = args.output == "mongo"
+    role: Optional[str] = None
+    if to_mongo:
+        await mongodb.connect()
+        if args.user_id:
+            owner = await mongodb.db["users"].find_one({"_id": ObjectId(args.user_id)}, {"role": 1})
+            role = (owner or {}).get("role")
+    out_fh, written = (None, set()) if to_mongo else _open_jsonl(args.output)
+
+    progress = Progress(len(todo))
+    sem = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+    # Preprocessed images wait here for a provider slot; the bound keeps memory
+    # flat while the process pool runs ahead of the provider calls.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * args.concurrency)
+    pending = iter(todo)
+    workers = args.workers or os.cpu_count() or 1
+
+    async def preprocess(pool: ProcessPoolExecutor) -> None:
+        for item in pending:
+            try:
+                pre = await loop.run_in_executor(pool, _preprocess, item["path"], args.max_side)
+            except Exception as e:
+                pre = e
+            await queue.put((item, pre))
+
+    async def process(item: Dict[str, Any], pre: Any) -> None:
+        path = item["path"]
+        try:
+            if isinstance(pre, Exception):
+                raise pre
+            scan_id = state.scan_id(path, pre["sha256"])
+            # Written by an interrupted earlier run before it could checkpoint
+            if str(scan_id) in written or (
+                to_mongo and await mongodb.db["scans"].find_one({"_id": scan_id}, {"_id": 1})
+            ):
+                state.record(path, {"status": "ok", "scan_id": str(scan_id)})
+                progress.tick(True)
+                return
+            async with sem:
+                resp, used_model = await call_provider(args.provider, prompt, [pre["contents"]], args.model, schema=schema)
+            raw = resp.get("response", "")
+            structured, validation = validate_structured(args.question_id, _extract_structured_json(raw))
+            now = datetime.utcnow()
+            result: Dict[str, Any] = {"image_hash": pre["sha256"], "source_path": path, "response": raw}
+            if pre["phash"]:
+                result["phash"] = pre["phash"]
+            doc: Dict[str, Any] = {
+                "_id": scan_id,
+                "user_id": ObjectId(args.user_id) if args.user_id else None,
+                "question_id": args.question_id,
+                "model": used_model,
+                "provider": args.provider,
+                "results": [result],
+                "images_count": 1,
+                "created_at": now,
+                "source": "batch",
+                "validation": validation,
+            }
+            expire_at = expiry_for(role, now)
+            if expire_at:
+                doc["expire_at"] = expire_at
+            prop = {k: item[k] for k in ("address", "postcode", "city") if item.get(k)}
+            if prop:
+                doc["property"] = prop
+            if pre["phash"]:
+                doc["phash"] = pre["phash"]
+            if resp.get("usage"):
+                result["usage"] = doc["usage"] = resp["usage"]
+            if structured is not None:
+                doc["structured"] = structured
+            if raw:
+                doc["raw_text"] = raw
+            if to_mongo:
+                stored = await store_image(pre["contents"], path)
+                result.update({"image_id": stored["hash"], "image_path": stored["filename"]})
+                doc["preview_image_id"] = stored["hash"]
+                try:
+                    await insert_scan(doc)
+                except DuplicateKeyError:
+                    state.record(path, {"status": "ok", "scan_id": str(scan_id)})
+                    progress.tick(True)
+                    return
+                await record_usage(doc["user_id"], args.question_id, doc.get("usage"), now=now)
+                await record_scan(doc)
+            else:
+                out_fh.write(dumps(doc) + b"\n")
+                out_fh.flush()
+            state.record(path, {"status": "ok", "scan_id": str(doc["_id"])})
+            progress.tick(True)
+        except Exception as e:
+            state.record(path, {"status": "error", "error": str(e)[:300]})
+            progress.tick(False)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            producers = [asyncio.create_task(preprocess(pool)) for _ in range(min(len(todo), workers))]
+
+            async def provide() -> None:
+                while True:
+                    got = await queue.get()
+                    if got is None:
+                        return
+                    await process(*got)
+
+            providers = [asyncio.create_task(provide()) for _ in range(2 * args.concurrency)]
+            await asyncio.gather(*producers)
+            for _ in providers:
+                await queue.put(None)
+            await asyncio.gather(*providers)
+    finally:
+        state.close()
+        if out_fh:
+            out_fh.close()
+        if to_mongo:
+            await mongodb.disconnect()
+    elapsed = time.monotonic() - progress.started
+    print(f"done: {progress.done - progress.failed} ok, {progress.failed} failed in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if progress.failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Analyze a directory or manifest of survey photos offline.")
+    ap.add_argument("path", nargs="?", help="directory to walk for images")
+    ap.add_argument("--manifest", help="file with one image path (or JSON object with 'path') per line")
+    ap.add_argument("--question-id", default="rics_single_image", choices=sorted(QUESTIONS))
+    ap.add_argument("--provider", default="ollama", choices=["ollama", "openai"])
+    ap.add_argument("--model", default=None)
+    ap.add_argument("--user-id", default=None, help="owner ObjectId for scans written to Mongo")
+    ap.add_argument("--output", default="mongo", help="'mongo' or a JSONL file path")
+    ap.add_argument("--state", default="batch_state.json", help="checkpoint file used to resume runs")
+    ap.add_argument("--concurrency", type=int, default=4, help="concurrent provider calls")
+    ap.add_argument("--workers", type=int, default=None, help="preprocessing processes")
+    ap.add_argument("--max-side", type=int, default=0, help="downscale images to this many pixels (0 = keep)")
+    ap.add_argument("--retry-failed", action="store_true", help="reprocess items that failed in a previous run")
+    args = ap.parse_args(argv)
+    if not args.path and not args.manifest:
+        ap.error("give a directory and/or --manifest")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+from bson import Binary
+
+from db import mongodb
+
+
+# Caches are named namespaces on top of two levels:
+#  - a per-process LRU (size- and TTL-bounded), always on;
+#  - an optional shared backend so uvicorn workers and replicas see the same
+#    entries and share upstream calls. CACHE_BACKEND=mongo stores entries in
+#    the `cache` collection (TTL index on expire_at, values as JSON).
+# With a shared backend the local copy lives at most CACHE_LOCAL_TTL seconds,
+# which bounds how long another worker's delete can go unnoticed.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "5"))
+
+_MISSING = object()
+
+
+class MemoryLRU:
+    """In-process LRU with per-entry expiry; also the stand-in for a shared backend.
+
+    The ``*_nowait`` methods serve synchronous callers such as ``auth.parse_authorization``.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get_nowait(self, key: str, default: Any = _MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set_nowait(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete_nowait(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def get(self, key: str) -> Any:
+        return self.get_nowait(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self.set_nowait(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self.delete_nowait(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class MongoCache:
+    """Shared backend on a Mongo collection; expired documents are removed by a TTL index."""
+
+    def __init__(self, collection: str = "cache") -> None:
+        self.collection = collection
+
+    def _coll(self):
+        return mongodb.db[self.collection]
+
+    async def get(self, key: str) -> Any:
+        doc = await self._coll().find_one({"_id": key, "expire_at": {"$gt": datetime.utcnow()}})
+        if doc is None:
+            return _MISSING
+        return orjson.loads(bytes(doc["value"]))
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        doc = {"value": Binary(orjson.dumps(value)), "expire_at": datetime.utcnow() + timedelta(seconds=ttl)}
+        await self._coll().replace_one({"_id": key}, doc, upsert=True)
+
+    async def delete(self, key: str) -> None:
+        await self._coll().delete_one({"_id": key})
+
+
+def _shared_backend() -> Optional[Any]:
+    if CACHE_BACKEND == "mongo":
+        return MongoCache()
+    return None
+
+
+class Cache:
+    """A cache namespace: TTL, size bound, single-flight loads and hit/miss counters."""
+
+    def __init__(self, namespace: str, ttl: float, max_entries: int = 1024, shared: Any = _MISSING) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = MemoryLRU(max_entries)
+        self.shared = _shared_backend() if shared is _MISSING else shared
+        self.stats: Counter = Counter()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        register(namespace, self)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = await self.local.get(key)
+        if value is not _MISSING:
+            self.stats["hits"] += 1
+            return value
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(self._key(key))
+            except Exception:
+                self.stats["shared_errors"] += 1
+                value = _MISSING
+            if value is not _MISSING:
+                self.stats["shared_hits"] += 1
+                await self.local.set(key, value, min(self.ttl, CACHE_LOCAL_TTL))
+                return value
+        self.stats["misses"] += 1
+        return default
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if self.shared is not None:
+            try:
+                await self.shared.set(self._key(key), value, ttl)
+            except Exception:
+                self.stats["shared_errors"] += 1
+            ttl = min(ttl, CACHE_LOCAL_TTL)
+        await self.local.set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.local.delete(key)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(self._key(key))
+            except Exception:
+                self.stats["shared_errors"] += 1
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """Cached value, or ``await loader()`` once per key however many callers are waiting.
+
+        Loader exceptions propagate to every waiter and nothing is cached.
+        """
+        value = await self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The loading caller went away (client disconnect); load ourselves
+                return await self.get_or_load(key, loader, ttl)
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.stats["loads"] += 1
+            value = await loader()
+            await self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.stats["load_errors"] += 1
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody else awaited is not logged
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["shared_hits"]) / lookups if lookups else 0.0
+        return {
+            **self.stats,
+            "hit_rate": round(hit_rate, 4),
+            "local_entries": len(self.local),
+            "shared": type(self.shared).__name__ if self.shared is not None else None,
+        }
+
+
+_registry: Dict[str, Any] = {}
+
+
+def register(name: str, cache: Any) -> None:
+    """Include ``cache`` (anything with ``snapshot()``) in :func:`cache_stats`."""
+    _registry[name] = cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {name: c.snapshot() for name, c in _registry.items()}
@@ -1,15 +1,62 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
 
+log = logging.getLogger("db")
+
+# (collection, keys, create_index options) for every index the app relies on
+INDEXES: List[Tuple[str, Any, Dict[str, Any]]] = [
+    ("users", "email", {"unique": True}),
+    # History, export and unfiltered search pages: (created_at, _id) desc per user
+    ("scans", [("user_id", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("scans", "results.image_path", {}),
+    ("scans", [("property.postcode", 1), ("created_at", -1)], {}),
+    # Search (search.py): text index and facet filters, all scoped to one user
+    (
+        "scans",
+        [
+            ("user_id", 1),
+            ("search.title", "text"),
+            ("search.summary", "text"),
+            ("search.findings", "text"),
+            ("search.keywords", "text"),
+            ("search.highlights", "text"),
+        ],
+        {
+            "name": "scans_search_text",
+            "weights": {"search.title": 10, "search.keywords": 5, "search.highlights": 5, "search.findings": 2, "search.summary": 1},
+            "default_language": "english",
+        },
+    ),
+    ("scans", [("user_id", 1), ("risk_level", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("scans", [("user_id", 1), ("survey.level", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("scans", [("user_id", 1), ("property.postcode", 1), ("created_at", -1), ("_id", -1)], {}),
+    ("usage_daily", [("user_id", 1), ("day", -1)], {}),
+    ("usage_daily", "day", {}),
+    ("analytics_daily", [("dim", 1), ("key", 1), ("day", 1)], {}),
+    ("surveys", [("user_id", 1), ("created_at", -1)], {}),
+    # Retention: documents are removed once `expire_at` has passed
+    ("scans", "expire_at", {"expireAfterSeconds": 0}),
+    ("scan_payloads", "expire_at", {"expireAfterSeconds": 0}),
+    ("surveys", "expire_at", {"expireAfterSeconds": 0}),
+    ("cache", "expire_at", {"expireAfterSeconds": 0}),
+    ("revoked_tokens", "expire_at", {"expireAfterSeconds": 0}),
+    ("revoked_tokens", "revoked_at", {}),
+]
+
+
 class MongoDB:
     def __init__(self) -> None:
         self._client: Optional[AsyncIOMotorClient] = None
         self._db: Optional[AsyncIOMotorDatabase] = None
+        self.index_status: Dict[str, Any] = {"ready": False}
 
     @property
     def db(self) -> AsyncIOMotorDatabase:
@@ -20,11 +67,41 @@ class MongoDB:
     async def connect(self) -> None:
         uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
         dbname = os.getenv("MONGODB_DB", "ukrics")
+        # No I/O here: the driver connects on first use and indexes are ensured
+        # by ensure_indexes_forever() in the background
         self._client = AsyncIOMotorClient(uri)
         self._db = self._client[dbname]
-        # Create indexes
-        await self._db["users"].create_index("email", unique=True)
-        await self._db["scans"].create_index([("user_id", 1), ("created_at", -1)])
+
+    async def ensure_indexes(self) -> Dict[str, Any]:
+        """Create every index in INDEXES concurrently; safe to repeat."""
+        started = time.perf_counter()
+
+        async def _one(collection: str, keys: Any, options: Dict[str, Any]) -> None:
+            await self.db[collection].create_index(keys, **options)
+
+        results = await asyncio.gather(*(_one(*spec) for spec in INDEXES), return_exceptions=True)
+        errors = [f"{spec[0]} {spec[1]}: {r}" for spec, r in zip(INDEXES, results) if isinstance(r, Exception)]
+        self.index_status = {
+            "ready": not errors,
+            "indexes": len(INDEXES),
+            "errors": errors[:10],
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        return self.index_status
+
+    async def ensure_indexes_forever(self, retry_max: float = 60) -> None:
+        """Background startup task: retry with backoff until every index exists."""
+        delay = 1.0
+        while True:
+            try:
+                status = await self.ensure_indexes()
+            except Exception as e:
+                status = self.index_status = {"ready": False, "errors": [str(e)[:300]]}
+            if status["ready"]:
+                return
+            log.warning("ensuring indexes failed, retrying in %.0fs: %s", delay, status["errors"][:1])
+            await asyncio.sleep(delay)
+            delay = min(retry_max, delay * 2)
 
     async def disconnect(self) -> None:
         if self._client:
@@ -32,11 +109,12 @@ class MongoDB:
         self._client = None
         self._db = None
 
-    async def ping(self) -> bool:
+    async def ping(self, timeout: float = 2.0) -> bool:
         if not self._client:
             return False
         try:
-            await self._client.admin.command("ping")
+            # Bounded: health probes must answer even while the server is unreachable
+            await asyncio.wait_for(self._client.admin.command("ping"), timeout)
             return True
         except Exception:
             return False
@@ -0,0 +1,16 @@
+"""Load backend/.env into the environment, once, before settings are read.
+
+Modules read their configuration from ``os.getenv`` at import time, so entry
+points (main.py, auth.py) import this module first.
+"""
+try:
+    from dotenv import load_dotenv  # type: ignore
+except Exception:
+    load_dotenv = None  # type: ignore
+
+if load_dotenv:
+    try:
+        load_dotenv()
+    except Exception:
+        # A malformed .env must not stop the app from starting
+        pass
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import os
+import zipfile
+import zlib
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from db import mongodb
+from responses import dumps
+from scan_store import decode_payload, merge_scan
+from search import after_cursor, encode_cursor
+from storage import UPLOAD_ROOT
+
+
+# Streaming export of a user's scans. Summaries are read from a keyset-ordered
+# cursor (newest first) and their payloads fetched per batch, so memory stays
+# bounded by EXPORT_BATCH_SIZE documents plus one output chunk whatever the
+# history size. Every record carries the keyset `cursor` of its scan: passing
+# the last one received as ?cursor= resumes an interrupted export after it.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "200"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+FILE_CHUNK_BYTES = 256 * 1024
+
+FORMATS = ("jsonl", "csv", "zip")
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv; charset=utf-8", "zip": "application/zip"}
+
+# Summary fields that are never exported (search copies, dedup fingerprints)
+SUMMARY_PROJECTION = {"search": 0, "phash": 0}
+
+CSV_COLUMNS = [
+    "id", "created_at", "question_id", "provider", "model", "title", "risk_level", "survey_level",
+    "address", "postcode", "city", "summary", "findings", "keywords", "highlights",
+    "recommended_actions", "image_urls", "cursor",
+]
+
+
+async def _scans(query: Dict[str, Any], cursor: Optional[str], include_raw: bool) -> AsyncIterator[Dict[str, Any]]:
+    keyset = after_cursor(cursor)
+    find = mongodb.db["scans"].find(
+        {**query, **keyset},
+        SUMMARY_PROJECTION,
+        batch_size=EXPORT_BATCH_SIZE,
+    ).sort([("created_at", -1), ("_id", -1)])
+    batch: List[Dict[str, Any]] = []
+    async for summary in find:
+        batch.append(summary)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            for doc in await _with_payloads(batch, include_raw):
+                yield doc
+            batch = []
+    if batch:
+        for doc in await _with_payloads(batch, include_raw):
+            yield doc
+
+
+async def _with_payloads(summaries: List[Dict[str, Any]], include_raw: bool) -> List[Dict[str, Any]]:
+    # One $in query per batch instead of one lookup per scan
+    # Legacy documents (no has_payload) still carry their heavy fields inline
+    ids = [s["_id"] for s in summaries if s.get("has_payload")]
+    bodies: Dict[Any, Dict[str, Any]] = {}
+    if ids:
+        async for p in mongodb.db["scan_payloads"].find({"_id": {"$in": ids}}, batch_size=len(ids)):
+            bodies[p["_id"]] = decode_payload(p)
+    out: List[Dict[str, Any]] = []
+    for s in summaries:
+        doc = merge_scan(s, bodies.get(s["_id"], {}))
+        if not include_raw:
+            doc.pop("raw_text", None)
+            for r in doc.get("results") or []:
+                r.pop("response", None)
+        out.append(doc)
+    return out
+
+
+def _record(doc: Dict[str, Any], image_url: Callable[[str], str]) -> Dict[str, Any]:
+    doc = dict(doc)
+    doc["id"] = doc.pop("_id")
+    doc.pop("user_id", None)
+    doc.pop("expire_at", None)
+    for r in doc.get("results") or []:
+        if r.get("image_path") and not r.get("image_url"):
+            r["image_url"] = image_url(r["image_path"])
+    doc["cursor"] = encode_cursor(doc["created_at"], doc["id"])
+    return doc
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode("utf-8")
+    return str(value)
+
+
+def _joined(value: Any) -> str:
+    if isinstance(value, list):
+        return "; ".join(_cell(v) for v in value if v not in (None, ""))
+    return _cell(value)
+
+
+# Spreadsheets run cells starting with these as formulas; a leading ' makes them text
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _safe(cell: str) -> str:
+    return "'" + cell if cell.startswith(_FORMULA_PREFIXES) else cell
+
+
+def _csv_row(rec: Dict[str, Any]) -> List[str]:
+    structured = rec.get("structured") if isinstance(rec.get("structured"), dict) else {}
+    verdict = structured.get("verdict") if isinstance(structured.get("verdict"), dict) else {}
+    prop = rec.get("property") or {}
+    created = rec.get("created_at")
+    return [_safe(cell) for cell in (
+        str(rec["id"]),
+        created.isoformat() if hasattr(created, "isoformat") else _joined(created),
+        _joined(rec.get("question_id")),
+        _joined(rec.get("provider")),
+        _joined(rec.get("model")),
+        _joined(rec.get("title") or structured.get("title")),
+        _joined(rec.get("risk_level")),
+        _joined((rec.get("survey") or {}).get("level")),
+        _joined(prop.get("address")),
+        _joined(prop.get("postcode")),
+        _joined(prop.get("city")),
+        _joined(structured.get("summary") or verdict.get("condition")),
+        _joined(structured.get("findings")),
+        _joined(structured.get("keywords")),
+        _joined(structured.get("highlights")),
+        _joined(structured.get("recommended_actions")),
+        " ".join(r["image_url"] for r in rec.get("results") or [] if r.get("image_url")),
+        rec["cursor"],
+    )]
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, non-seekable stream collecting bytes until drained (zipfile target)."""
+
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+        self.size = 0
+        self.pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Any) -> int:
+        data = bytes(b)
+        self.parts.append(data)
+        self.size += len(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # zipfile records offsets via tell(); there is no seek()
+        return self.pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts, self.size = [], 0
+        return data
+
+
+async def _jsonl(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    buf: List[bytes] = []
+    size = 0
+    async for rec in records:
+        line = dumps(rec) + b"\n"
+        buf.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+async def _csv(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    text = io.StringIO()
+    writer = csv.writer(text)
+    # BOM so spreadsheet apps detect UTF-8
+    text.write("﻿")
+    writer.writerow(CSV_COLUMNS)
+    async for rec in records:
+        writer.writerow(_csv_row(rec))
+        if text.tell() >= EXPORT_CHUNK_BYTES:
+            yield text.getvalue().encode("utf-8")
+            text.seek(0)
+            text.truncate()
+    if text.tell():
+        yield text.getvalue().encode("utf-8")
+
+
+async def _zip(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    sink = _Sink()
+    written: set = set()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        async for rec in records:
+            zf.writestr(f"scans/{rec['id']}.json", dumps(rec))
+            for r in rec.get("results") or []:
+                name = r.get("image_path")
+                if not name or name in written:
+                    continue
+                path = UPLOAD_ROOT / name
+                if not path.is_file():
+                    continue
+                written.add(name)
+                # Photos are already compressed: store them as-is
+                with open(path, "rb") as src, zf.open(zipfile.ZipInfo(f"images/{name}"), mode="w", force_zip64=True) as dst:
+                    while True:
+                        chunk = await asyncio.to_thread(src.read, FILE_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        if sink.size >= EXPORT_CHUNK_BYTES:
+                            yield sink.drain()
+            if sink.size >= EXPORT_CHUNK_BYTES:
+                yield sink.drain()
+    yield sink.drain()
+
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    async for chunk in chunks:
+        out = gz.compress(chunk)
+        if out:
+            yield out
+    yield gz.flush()
+
+
+def export_stream(
+    query: Dict[str, Any],
+    fmt: str,
+    image_url: Callable[[str], str],
+    cursor: Optional[str] = None,
+    gzip: bool = False,
+    include_raw: bool = False,
+) -> AsyncIterator[bytes]:
+    """Byte chunks of the export; ``query`` comes from :func:`search.build_query`.
+
+    Raises ValueError for a malformed ``cursor`` before anything is streamed.
+    """
+    after_cursor(cursor)
+
+    async def records() -> AsyncIterator[Dict[str, Any]]:
+        async for doc in _scans(query, cursor, include_raw):
+            yield _record(doc, image_url)
+
+    writer = {"jsonl": _jsonl, "csv": _csv, "zip": _zip}[fmt]
+    stream = writer(records())
+    # A ZIP is already compressed
+    return _gzip(stream) if gzip and fmt != "zip" else stream
+
+
+def export_filename(fmt: str, gzip: bool, stamp: str) -> str:
+    name = f"scans-{stamp}.{fmt}"
+    return name + ".gz" if gzip and fmt != "zip" else name
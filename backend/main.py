@@ -1,34 +1,51 @@
 from __future__ import annotations
 
-import base64
+import asyncio
 import json
 import re
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple, Union
 import os
-import uuid
-from pathlib import Path
+import time
 
-import httpx
-from fastapi import FastAPI, File, Form, UploadFile, Header
+import env  # noqa: F401  (loads .env before any module reads its settings)
+from fastapi import FastAPI, File, Form, UploadFile, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
 from db import mongodb
-from prompts import QUESTIONS
-from auth import router as auth_router, parse_authorization
+from prompts import QUESTIONS, RESPONSE_SCHEMAS, resolve_prompt
+from auth import router as auth_router, create_download_token, parse_authorization, parse_download_token, sync_revocations_forever
+from storage import UPLOAD_ROOT, add_scan_references, existing_file, store_image, storage_stats, write_image
+from scan_store import insert_scan, load_scan
+from export import FORMATS as EXPORT_FORMATS, MEDIA_TYPES as EXPORT_MEDIA_TYPES, export_filename, export_stream
+from search import LIST_PROJECTION, SEARCH_PAGE_SIZE, build_query, search_scans
+from writebehind import WRITE_BEHIND_ENABLED, best_effort, scan_writer
+from retention import GC_INTERVAL_SECONDS, collect_orphans, expiry_for, gc_status, run_gc_forever
 from bson import ObjectId
-try:
-    from dotenv import load_dotenv  # type: ignore
-except Exception:
-    load_dotenv = None  # type: ignore
+from responses import ORJSONResponse, dumps as orjson_dumps
+from payloads import InvalidBase64, ollama_body, openai_body
+import upstream
+from cache import Cache, cache_stats
+from phash import PHASH_REUSE_DEFAULT, dhash, near_duplicates, scope_for, to_hex
+from analytics import DIMENSIONS, dashboard, record_failure, record_scan
+from usage import budget_exceeded, normalize_usage, record_usage, usage_report
+from validation import reask_prompt, validate_structured
+from survey import SURVEY_MAX_PHOTO_BYTES, SURVEY_WS_CONCURRENCY, SURVEY_WS_MAX_INFLIGHT, SurveySummary, add_photo, close_survey, open_survey
+from tts_cache import TTS_CACHE_EVICT_INTERVAL, cache_key as tts_cache_key, evict_forever as evict_tts_cache_forever, read_cached, tts_jobs, write_cached
+
+if TYPE_CHECKING:
+    import httpx
 
 
 # Allow overriding model and Ollama endpoint via environment
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
 MODEL_NAME = os.getenv("OLLAMA_MODEL", "llava:7b")
 
+# Re-ask the provider (text only, schema-constrained) when model output is unusable
+VALIDATION_REASK = os.getenv("VALIDATION_REASK", "true").lower() in ("1", "true", "yes")
+
 # OpenAI provider configuration (optional)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
@@ -38,22 +55,15 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 ELEVEN_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVEN_DEFAULT_VOICE = os.getenv("ELEVENLABS_VOICE_ID", "Rachel")  # can be name or voice_id
 ELEVEN_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_multilingual_v2")
-_ELEVEN_VOICES_CACHE: Dict[str, str] = {}
+# ElevenLabs voice list, shared by /api/tts/voices and voice-name resolution
+eleven_voices_cache = Cache("eleven_voices", ttl=float(os.getenv("ELEVENLABS_VOICES_TTL", "600")), max_entries=4)
 
 
 # Prompts are now managed in backend/prompts.py (imported above)
 
 
-if load_dotenv:
-    try:
-        load_dotenv()
-    except Exception:
-        pass
-
-app = FastAPI(title="HomeScan AI Backend")
+app = FastAPI(title="HomeScan AI Backend", default_response_class=ORJSONResponse)
 
-UPLOAD_ROOT = Path(os.getenv("IMAGE_UPLOAD_DIR", Path(__file__).resolve().parent / "uploaded_images"))
-UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
 UPLOAD_ROUTE = os.getenv("IMAGE_UPLOAD_ROUTE", "/assets/uploads")
 UPLOAD_ROUTE = "/" + UPLOAD_ROUTE.strip("/")
 IMAGE_PUBLIC_BASE = os.getenv("IMAGE_PUBLIC_BASE_URL") or os.getenv("PUBLIC_BASE_URL") or "http://localhost:8000"
@@ -67,14 +77,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request deadline for upstream calls; cancels handlers whose client disconnected
+app.add_middleware(upstream.DeadlineMiddleware)
+
 app.include_router(auth_router)
 app.mount(UPLOAD_ROUTE, StaticFiles(directory=str(UPLOAD_ROOT)), name="uploaded-images")
 
 @app.get("/health")
 def health() -> Dict[str, str]:
+    # Liveness: the process serves requests. Readiness is /health/ready.
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def health_ready() -> ORJSONResponse:
+    db_ok = await mongodb.ping()
+    indexes = mongodb.index_status
+    ready = db_ok and bool(indexes.get("ready"))
+    return ORJSONResponse(status_code=200 if ready else 503, content={"ready": ready, "db": db_ok, "indexes": indexes})
+
+
 @app.on_event("startup")
 async def _startup_db() -> None:
     try:
@@ -82,10 +104,29 @@ async def _startup_db() -> None:
     except Exception:
         # Do not crash the app if DB is unavailable; health/db will reflect status
         pass
+    else:
+        # Serve traffic right away; /health/ready turns green once indexes exist
+        app.state.index_task = asyncio.create_task(mongodb.ensure_indexes_forever())
+    if WRITE_BEHIND_ENABLED:
+        await scan_writer.start()
+    app.state.revocation_task = asyncio.create_task(sync_revocations_forever())
+    if GC_INTERVAL_SECONDS > 0:
+        app.state.gc_task = asyncio.create_task(run_gc_forever())
+    if ELEVEN_API_KEY:
+        # Warm the config so the first scan can schedule speculative TTS
+        _tts_config_nowait()
+    if TTS_CACHE_EVICT_INTERVAL > 0:
+        app.state.tts_evict_task = asyncio.create_task(evict_tts_cache_forever())
 
 
 @app.on_event("shutdown")
 async def _shutdown_db() -> None:
+    for name in ("index_task", "gc_task", "revocation_task", "tts_evict_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    if WRITE_BEHIND_ENABLED:
+        await scan_writer.stop()
     try:
         await mongodb.disconnect()
     except Exception:
@@ -95,7 +136,11 @@ async def _shutdown_db() -> None:
 @app.get("/health/db")
 async def health_db() -> Dict[str, Any]:
     ok = await mongodb.ping()
-    return {"ok": ok}
+    out: Dict[str, Any] = {"ok": ok}
+    if WRITE_BEHIND_ENABLED:
+        out["pending_writes"] = scan_writer.pending_count
+        out["quarantined_writes"] = scan_writer.quarantined
+    return out
 
 
 
@@ -107,48 +152,53 @@ def list_questions() -> Dict[str, Any]:
     }
 
 
-def _b64_image(file_bytes: bytes) -> str:
-    return base64.b64encode(file_bytes).decode("utf-8")
-
-
-async def call_ollama(prompt: str, b64_images: List[str], model: Optional[str] = None) -> Dict[str, Any]:
-    payload = {
-        "model": model or MODEL_NAME,
-        "prompt": prompt,
-        "images": b64_images,
-        "stream": False,
-    }
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(OLLAMA_URL, json=payload)
+async def call_ollama(prompt: str, images: List[Union[bytes, str]], model: Optional[str] = None, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # images: raw bytes (base64-encoded while streaming) or already-base64 strings
+    model = model or MODEL_NAME
+    body = ollama_body(model, prompt, images, schema=schema)
+    async with upstream.client() as client:
+        r = await upstream.request(client, "POST", OLLAMA_URL, service="ollama", model=model, shape="images" if images else "text", content=body, headers=body.headers)
         r.raise_for_status()
         data = r.json()
         # Ollama returns { response: str, ... }
         return data
 
 
-async def call_openai(prompt: str, b64_images: List[str], model: Optional[str] = None) -> Dict[str, Any]:
+async def call_openai(prompt: str, images: List[Union[bytes, str]], model: Optional[str] = None, schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY not configured")
-    # Build vision message: text + image URLs (data URIs)
-    content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
-    for b64 in b64_images:
-        content.append({
-            "type": "image_url",
-            "image_url": {"url": f"data:image/jpeg;base64,{b64}"},
-        })
-    payload = {
-        "model": model or OPENAI_MODEL,
-        "messages": [{"role": "user", "content": content}],
-        "temperature": 0.2,
-    }
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(f"{OPENAI_API_BASE}/chat/completions", headers=headers, json=payload)
+    model = model or OPENAI_MODEL
+    body = openai_body(model, prompt, images, schema=schema)
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", **body.headers}
+    async with upstream.client() as client:
+        r = await upstream.request(client, "POST", f"{OPENAI_API_BASE}/chat/completions", service="openai", model=model, shape="images" if images else "text", headers=headers, content=body)
         r.raise_for_status()
         data = r.json()
-        # Normalize to { response: str }
+        # Normalize to { response: str, usage: {...} }
         text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        return {"response": text}
+        return {"response": text, "usage": data.get("usage") or {}}
+
+
+async def call_provider(
+    provider: str,
+    prompt: str,
+    images: List[Union[bytes, str]],
+    model: Optional[str] = None,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """Dispatch to the provider's call_* function; returns (response, model used).
+
+    The response carries a normalized ``usage`` record (tokens, images, timings, cost).
+    """
+    chosen_model = _select_model(provider, model)
+    started = time.perf_counter()
+    if (provider or "").lower() == "openai":
+        resp = await call_openai(prompt, images, model=chosen_model, schema=schema)
+    else:
+        resp = await call_ollama(prompt, images, model=chosen_model, schema=schema)
+    wall_ms = (time.perf_counter() - started) * 1000
+    resp["usage"] = normalize_usage(provider, chosen_model, resp, wall_ms, images=len(images))
+    return resp, chosen_model
 
 
 class OpenAIChatRequest(BaseModel):
@@ -229,17 +279,19 @@ def health_openai() -> Dict[str, Any]:
 
 
 @app.post("/api/openai/chat", response_model=OpenAIChatResponse)
-async def openai_chat(body: OpenAIChatRequest) -> JSONResponse:
+async def openai_chat(body: OpenAIChatRequest) -> ORJSONResponse:
     if not OPENAI_API_KEY:
-        return JSONResponse(status_code=500, content={"ok": False, "model": OPENAI_MODEL, "response": "OPENAI_API_KEY not configured"})
+        return ORJSONResponse(status_code=500, content={"ok": False, "model": OPENAI_MODEL, "response": "OPENAI_API_KEY not configured"})
     try:
         images = [body.image_b64] if body.image_b64 else []
         chosen = _sanitize_model(body.model) or OPENAI_MODEL
         data = await call_openai(body.prompt, images, model=chosen)
         model_used = chosen
-        return JSONResponse(content={"ok": True, "model": model_used, "response": data.get("response", "")})
+        return ORJSONResponse(content={"ok": True, "model": model_used, "response": data.get("response", "")})
+    except InvalidBase64 as e:
+        return ORJSONResponse(status_code=400, content={"ok": False, "model": body.model or OPENAI_MODEL, "response": str(e)})
     except Exception as e:
-        return JSONResponse(status_code=502, content={"ok": False, "model": body.model or OPENAI_MODEL, "response": f"Error: {e}"})
+        return ORJSONResponse(status_code=502, content={"ok": False, "model": body.model or OPENAI_MODEL, "response": f"Error: {e}"})
 
 
 # ------------------ ElevenLabs Text-to-Speech ------------------
@@ -266,57 +318,91 @@ async def _resolve_eleven_voice_id(name_or_id: str, client: httpx.AsyncClient) -
         return v
     if len(v) > 20 and all(c.isalnum() or c in ('-', '_') for c in v):
         return v
-    # Try cache by name (case-insensitive)
+    # Map names -> ids from the (cached) voices list, case-insensitive
     key = v.lower()
-    if key in _ELEVEN_VOICES_CACHE:
-        return _ELEVEN_VOICES_CACHE[key]
-    # Fetch voices list and map names -> ids
-    headers = {"xi-api-key": ELEVEN_API_KEY or ""}
-    r = await client.get("https://api.elevenlabs.io/v1/voices", headers=headers)
-    r.raise_for_status()
-    data = r.json()
-    voices = data.get("voices", []) or []
-    for item in voices:
+    data = await _eleven_voices(client)
+    for item in data.get("voices", []) or []:
         nm = (item.get("name") or "").strip().lower()
         vid = item.get("voice_id") or ""
-        if nm and vid:
-            _ELEVEN_VOICES_CACHE[nm] = vid
-    return _ELEVEN_VOICES_CACHE.get(key, v)  # fallback to original
+        if nm == key and vid:
+            return vid
+    return v  # fallback to original
+
+
+async def _eleven_voices(client: httpx.AsyncClient) -> Dict[str, Any]:
+    async def _load() -> Dict[str, Any]:
+        r = await upstream.request(client, "GET", "https://api.elevenlabs.io/v1/voices", service="elevenlabs", default_timeout=30, headers={"xi-api-key": ELEVEN_API_KEY or ""})
+        r.raise_for_status()
+        return r.json()
+
+    return await eleven_voices_cache.get_or_load("all", _load)
 
 
 @app.get("/api/tts/voices")
 async def list_tts_voices():
     if not ELEVEN_API_KEY:
-        return JSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get("https://api.elevenlabs.io/v1/voices", headers={"xi-api-key": ELEVEN_API_KEY})
-        r.raise_for_status()
-        return JSONResponse(content={"ok": True, **r.json()})
+        return ORJSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
+    async with upstream.client() as client:
+        return ORJSONResponse(content={"ok": True, **await _eleven_voices(client)})
 
 
 @app.get("/api/tts/voices/{voice_id}")
 async def get_tts_voice(voice_id: str):
     if not ELEVEN_API_KEY:
-        return JSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(f"https://api.elevenlabs.io/v1/voices/{voice_id}", headers={"xi-api-key": ELEVEN_API_KEY})
+        return ORJSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
+    async with upstream.client() as client:
+        r = await upstream.request(client, "GET", f"https://api.elevenlabs.io/v1/voices/{voice_id}", service="elevenlabs", default_timeout=30, headers={"xi-api-key": ELEVEN_API_KEY})
         if r.status_code >= 400:
-            return JSONResponse(status_code=r.status_code, content={"ok": False, "detail": r.text})
-        return JSONResponse(content={"ok": True, **r.json()})
+            return ORJSONResponse(status_code=r.status_code, content={"ok": False, "detail": r.text})
+        return ORJSONResponse(content={"ok": True, **r.json()})
+
+
+class TTSUpstreamError(Exception):
+    def __init__(self, status: int, detail: str, voice_id: str, model_id: str) -> None:
+        super().__init__(f"TTS upstream error {status}")
+        self.status = status
+        self.detail = detail
+        self.voice_id = voice_id
+        self.model_id = model_id
+
+
+async def _synthesize_speech(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any], client: httpx.AsyncClient) -> bytes:
+    payload: Dict[str, Any] = {
+        "text": text,
+        "model_id": model_id,
+    }
+    if voice_settings:
+        payload["voice_settings"] = voice_settings
+
+    headers = {
+        "xi-api-key": ELEVEN_API_KEY or "",
+        "Accept": "audio/mpeg",
+        "Content-Type": "application/json",
+    }
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}?optimize_streaming_latency=0"
+    r = await upstream.request(client, "POST", url, service="elevenlabs_tts", model=model_id, default_timeout=60, headers=headers, json=payload)
+    if r.status_code >= 400:
+        detail = r.text
+        if len(detail) > 400:
+            detail = detail[:400] + "…"
+        raise TTSUpstreamError(r.status_code, detail, voice_id, model_id)
+    return r.content
+
+
+def _audio_response(audio: bytes) -> Response:
+    return Response(content=audio, media_type="audio/mpeg", headers={"Content-Disposition": "inline; filename=voice.mp3"})
 
 
 @app.post("/api/tts")
 async def tts_generate(body: TTSRequest):
+    import httpx
+
     if not ELEVEN_API_KEY:
-        return JSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
+        return ORJSONResponse(status_code=500, content={"ok": False, "error": "ELEVENLABS_API_KEY not configured"})
 
     voice_name_or_id = (body.voice_id or ELEVEN_DEFAULT_VOICE).strip()
     model_id = (body.model_id or ELEVEN_MODEL_ID).strip()
 
-    payload: Dict[str, Any] = {
-        "text": body.text,
-        "model_id": model_id,
-    }
     # Attach voice settings if any
     vs: Dict[str, Any] = {}
     if body.stability is not None:
@@ -327,38 +413,51 @@ async def tts_generate(body: TTSRequest):
         vs["style"] = body.style
     if body.use_speaker_boost is not None:
         vs["use_speaker_boost"] = body.use_speaker_boost
-    if vs:
-        payload["voice_settings"] = vs
-
-    headers = {
-        "xi-api-key": ELEVEN_API_KEY,
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-    }
 
+    # Keyed by the voice as requested (name or id), so speculative clips need no voice lookup.
+    # Served from the cache when a scan already synthesized (or is synthesizing) this clip
+    key = tts_cache_key(body.text, voice_name_or_id, model_id, vs)
+    audio = await tts_jobs.wait(key) if tts_jobs.pending(key) else read_cached(key)
+    if audio is not None:
+        return _audio_response(audio)
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
+        async with upstream.client() as client:
             # Resolve voice id if a name was provided
             voice_id = await _resolve_eleven_voice_id(voice_name_or_id, client)
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}?optimize_streaming_latency=0"
-            r = await client.post(url, headers=headers, json=payload)
-            if r.status_code >= 400:
-                detail = r.text
-                if len(detail) > 400:
-                    detail = detail[:400] + "…"
-                return JSONResponse(status_code=502, content={
-                    "ok": False,
-                    "error": "TTS upstream error",
-                    "status": r.status_code,
-                    "detail": detail,
-                    "voice_id": voice_id,
-                    "model_id": model_id,
-                })
-            audio = r.content
-            from fastapi import Response
-            return Response(content=audio, media_type="audio/mpeg", headers={"Content-Disposition": "inline; filename=voice.mp3"})
+            audio = await _synthesize_speech(body.text, voice_id, model_id, vs, client)
+            write_cached(key, audio)
+            return _audio_response(audio)
+    except TTSUpstreamError as e:
+        return ORJSONResponse(status_code=502, content={
+            "ok": False,
+            "error": "TTS upstream error",
+            "status": e.status,
+            "detail": e.detail,
+            "voice_id": e.voice_id,
+            "model_id": e.model_id,
+        })
+    except upstream.DeadlineExceeded as e:
+        return ORJSONResponse(status_code=504, content={"ok": False, "error": f"TTS failed: {e}"})
     except httpx.HTTPError as e:
-        return JSONResponse(status_code=502, content={"ok": False, "error": f"TTS failed: {e}"})
+        return ORJSONResponse(status_code=502, content={"ok": False, "error": f"TTS failed: {e}"})
+
+
+@app.get("/api/tts/cache/{key}")
+async def tts_cached(key: str):
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        return ORJSONResponse(status_code=404, content={"ok": False, "error": "Not found"})
+    audio = await tts_jobs.wait(key)
+    if audio is None:
+        return ORJSONResponse(status_code=404, content={"ok": False, "error": "Not found"})
+    return _audio_response(audio)
+
+
+@app.delete("/api/tts/jobs/{key}")
+async def tts_cancel(key: str, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if tts_jobs.pending(key) and claims.get("role") != "admin" and tts_jobs.owner(key) != claims.get("sub"):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Not your job"})
+    return ORJSONResponse({"ok": True, "cancelled": tts_jobs.cancel(key)})
 
 
 # ------------------ TTS Config (admin) ------------------
@@ -397,32 +496,104 @@ def _default_tts_config() -> Dict[str, Any]:
     }
 
 
-@app.get("/api/tts/config")
-async def get_tts_config() -> JSONResponse:
-    try:
-        coll = mongodb.db["settings"]
-        doc = await coll.find_one({"_id": "tts_config"})
+tts_config_cache = Cache("tts_config", ttl=30, max_entries=1)
+# Last config loaded, for callers that must not wait on Mongo (speculative TTS)
+_tts_config_last: Optional[Dict[str, Any]] = None
+_tts_config_refresh: Optional[asyncio.Task] = None
+
+
+async def _load_tts_config() -> Dict[str, Any]:
+    global _tts_config_last
+
+    async def _load() -> Dict[str, Any]:
+        doc = await mongodb.db["settings"].find_one({"_id": "tts_config"})
         if not doc:
-            return JSONResponse({"ok": True, "config": _default_tts_config()})
+            return _default_tts_config()
         doc.pop("_id", None)
-        return JSONResponse({"ok": True, "config": doc})
+        return doc
+
+    try:
+        # Copied so callers cannot mutate the cached dict
+        cfg = dict(await tts_config_cache.get_or_load("config", _load))
     except Exception:
-        return JSONResponse({"ok": True, "config": _default_tts_config()})
+        return _default_tts_config()
+    _tts_config_last = cfg
+    return dict(cfg)
+
+
+def _tts_config_nowait() -> Optional[Dict[str, Any]]:
+    """Cached TTS config without awaiting; reloads it in the background once stale.
+
+    Returns the last loaded config meanwhile, or None before the first load.
+    """
+    global _tts_config_refresh
+    cached = tts_config_cache.local.get_nowait("config", None)
+    if cached is not None:
+        return dict(cached)
+    if _tts_config_refresh is None or _tts_config_refresh.done():
+        _tts_config_refresh = asyncio.create_task(_load_tts_config())
+    return dict(_tts_config_last) if _tts_config_last is not None else None
+
+
+@app.get("/api/tts/config")
+async def get_tts_config() -> ORJSONResponse:
+    return ORJSONResponse({"ok": True, "config": await _load_tts_config()})
 
 
 @app.put("/api/tts/config")
-async def put_tts_config(body: TTSConfig, authorization: Optional[str] = Header(default=None)) -> JSONResponse:
+async def put_tts_config(body: TTSConfig, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
     # Require admin
     claims = parse_authorization(authorization)
     if (claims or {}).get("role") not in ("admin",):
-        return JSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
     cfg = {k: v for k, v in body.dict().items() if v is not None or k in ("effects_enabled","auto_intro_on_load","auto_read_summary","auto_read_keywords")}
     try:
         coll = mongodb.db["settings"]
         await coll.update_one({"_id": "tts_config"}, {"$set": cfg}, upsert=True)
-        return JSONResponse({"ok": True})
+        await tts_config_cache.delete("config")
+        return ORJSONResponse({"ok": True})
     except Exception as e:
-        return JSONResponse(status_code=500, content={"ok": False, "error": f"Failed to save config: {e}"})
+        return ORJSONResponse(status_code=500, content={"ok": False, "error": f"Failed to save config: {e}"})
+
+
+def _speculative_tts(raw_text: Optional[str], owner: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Start synthesizing the clip the TTS widget auto-reads for a new scan.
+
+    The widget reads the first 800 characters of the raw model output and plays
+    ``tts.summary.url`` from the scan response instead of calling /api/tts.
+    Returns ``{"summary": {"key", "url"}}`` for a clip scheduled or already cached.
+    Nothing here waits: the config comes from the cache, and the voice lookup
+    and synthesis run in the background job.
+    """
+    if not ELEVEN_API_KEY:
+        return None
+    cfg = _tts_config_nowait()
+    if cfg is None or not cfg.get("auto_read_summary") or not raw_text:
+        return None
+    text = raw_text[:800]
+    voice = (cfg.get("default_voice_id") or cfg.get("default_voice_name") or ELEVEN_DEFAULT_VOICE).strip()
+    model_id = (cfg.get("model_id") or ELEVEN_MODEL_ID).strip()
+    key = tts_cache_key(text, voice, model_id, {})
+
+    async def _job() -> bytes:
+        # Outlives the scan request, so it is not bound by that request's deadline
+        with upstream.deadline_scope(None):
+            async with upstream.client() as client:
+                voice_id = await _resolve_eleven_voice_id(voice, client)
+                return await _synthesize_speech(text, voice_id, model_id, {}, client)
+
+    tts_jobs.schedule(key, _job, owner=owner)
+    return {"summary": {"key": key, "url": f"/api/tts/cache/{key}"}}
+
+
+async def _record_flushed_usage(doc: Dict[str, Any]) -> None:
+    await record_usage(doc.get("user_id"), doc.get("question_id"), doc.get("usage"), reused=bool(doc.get("reused")), now=doc.get("created_at"))
+
+
+# Write-behind: work that needs Mongo runs once the scan is actually inserted
+scan_writer.after_insert(add_scan_references)
+scan_writer.after_insert(_record_flushed_usage)
+scan_writer.after_insert(record_scan)
 
 
 @app.post("/api/scan")
@@ -436,61 +607,89 @@ async def scan_image(
     property_postcode: Optional[str] = Form(None),
     property_city: Optional[str] = Form(None),
     survey_level: Optional[int] = Form(3),
+    reuse_similar: Optional[bool] = Form(None),
     authorization: Optional[str] = Header(default=None),
-) -> JSONResponse:
+) -> ORJSONResponse:
     # Require auth and get user id
     claims = parse_authorization(authorization)
     user_id = claims.get("sub")
     if question_id not in QUESTIONS:
         question_id = "rics_analyze"
 
-    prompt = QUESTIONS[question_id]
     provider = (provider or "ollama").lower()
+    # Inline template or compact prompt + provider-side JSON schema, per PROMPT_VARIANT_<PROVIDER>
+    prompt, schema = resolve_prompt(question_id, provider)
     to_process: List[UploadFile] = []
     if files:
         to_process.extend(files)
     if file:
         to_process.append(file)
     if not to_process:
-        return JSONResponse(status_code=400, content={"ok": False, "error": "No files uploaded"})
+        return ORJSONResponse(status_code=400, content={"ok": False, "error": "No files uploaded"})
     # Only accept a single image for analysis; ignore extra uploads
     if len(to_process) > 1:
         to_process = [to_process[0]]
 
+    # With write-behind these reads are bounded and skipped when Mongo is unavailable
+    over = await best_effort(budget_exceeded(ObjectId(user_id) if user_id else None, claims.get("role")), None)
+    if over:
+        return ORJSONResponse(status_code=429, content={"ok": False, "error": "Daily token budget exceeded", **over})
+
+    reuse = PHASH_REUSE_DEFAULT if reuse_similar is None else bool(reuse_similar)
+    phash_scope = scope_for(user_id, {"address": property_address, "postcode": property_postcode})
+    phash_value: Optional[int] = None
+    reused: Optional[Dict[str, Any]] = None
+
     results: List[Dict[str, Any]] = []
-    try:
-        for f in to_process:
-            contents = await f.read()
-            if not contents:
-                continue
-            b64 = _b64_image(contents)
-            if provider == "openai":
-                chosen_model = _select_model(provider, model)
-                resp = await call_openai(prompt, [b64], model=chosen_model)
-                used_model = chosen_model
+    for f in to_process:
+        contents = await f.read()
+        if not contents:
+            continue
+        try:
+            phash_value = await asyncio.to_thread(dhash, contents)
+            if reuse and phash_value is not None:
+                # A near-identical photo analysed recently: reuse its analysis instead of the model
+                match = await best_effort(near_duplicates.find(phash_scope, phash_value, question_id), None)
+                if match:
+                    prior = await best_effort(load_scan({"_id": match[1]["scan_id"]}), None)
+                    if prior and prior.get("structured") is not None:
+                        # PHASH_SCOPE=property can match another user's scan: only its
+                        # structured result is reused, never its raw output or ids
+                        own = user_id is not None and prior.get("user_id") == ObjectId(user_id)
+                        reused = {"scan": prior, "distance": match[0], "own": own}
+            if reused:
+                resp = {"response": (reused["scan"].get("raw_text") or "") if reused["own"] else ""}
+                used_model = reused["scan"].get("model")
             else:
-                chosen_model = _select_model(provider, model)
-                resp = await call_ollama(prompt, [b64], model=chosen_model)
-                used_model = chosen_model
-
-            original_ext = os.path.splitext(f.filename or "")[1].lower()
-            if original_ext not in {".jpg", ".jpeg", ".png", ".webp"}:
-                original_ext = ".jpg"
-            file_id = uuid.uuid4().hex
-            filename = f"{file_id}{original_ext}"
-            filepath = UPLOAD_ROOT / filename
-            filepath.write_bytes(contents)
-
-            image_url = f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{filename}"
-
-            results.append({
-                "image_id": file_id,
-                "image_path": filename,
-                "image_url": image_url,
-                "response": resp.get("response", ""),
-            })
-    except Exception as e:
-        return JSONResponse(status_code=502, content={"ok": False, "error": f"Failed to query provider: {e}"})
+                resp, used_model = await call_provider(provider, prompt, [contents], model, schema=schema)
+        except Exception as e:
+            try:
+                await best_effort(record_failure(ObjectId(user_id) if user_id else None, provider), None)
+            except Exception:
+                pass
+            status = 504 if isinstance(e, upstream.DeadlineExceeded) else 502
+            return ORJSONResponse(status_code=status, content={"ok": False, "error": f"Failed to query provider: {e}"})
+
+        # Content-addressed: identical uploads share one file on disk. With
+        # write-behind the blob reference is taken when the scan is flushed.
+        if WRITE_BEHIND_ENABLED:
+            stored = await asyncio.to_thread(write_image, contents, f.filename)
+        else:
+            stored = await store_image(contents, f.filename)
+        filename = stored["filename"]
+        image_url = f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{filename}"
+
+        results.append({
+            "image_id": stored["hash"],
+            "image_hash": stored["hash"],
+            "image_path": filename,
+            "image_url": image_url,
+            "response": resp.get("response", ""),
+        })
+        if resp.get("usage"):
+            results[-1]["usage"] = resp["usage"]
+        if phash_value is not None:
+            results[-1]["phash"] = to_hex(phash_value)
 
     lead_image = results[0].get("image_url") if results else None
     lead_image_id = results[0].get("image_id") if results else None
@@ -507,6 +706,9 @@ async def scan_image(
     }
     if lead_image_id:
         doc["preview_image_id"] = lead_image_id
+    expire_at = expiry_for(claims.get("role"), now)
+    if expire_at:
+        doc["expire_at"] = expire_at
 # Optional metadata
     prop: Dict[str, Any] = {}
     if property_address:
@@ -531,7 +733,39 @@ async def scan_image(
     if not candidate_raw:
         candidate_raw = next((resp for resp in raw_responses if resp), None)
 
-    structured_json = _extract_structured_json(candidate_raw)
+    if reused:
+        structured_json = dict(reused["scan"]["structured"])
+        structured_json.pop("imageUrl", None)
+        doc["reused"] = True
+        if reused["own"]:
+            doc["reused_from"] = reused["scan"]["_id"]
+        else:
+            for key in ("id", "address"):
+                structured_json.pop(key, None)
+    else:
+        structured_json = _extract_structured_json(candidate_raw)
+    structured_json, validation = validate_structured(question_id, structured_json)
+    if not validation["ok"] and not reused and VALIDATION_REASK and candidate_raw and question_id in RESPONSE_SCHEMAS:
+        # One cheap repair attempt: no image, just the raw answer and the schema
+        try:
+            fixed, _ = await call_provider(provider, reask_prompt(candidate_raw), [], model, schema=RESPONSE_SCHEMAS[question_id])
+            fixed_json, fixed_validation = validate_structured(question_id, _extract_structured_json(fixed.get("response")))
+            validation = {**fixed_validation, "reasked": True, "reask_usage": fixed.get("usage")}
+            if fixed_validation["ok"]:
+                structured_json = fixed_json
+        except Exception as e:
+            validation["reask_error"] = str(e)[:300]
+    doc["validation"] = validation
+    if phash_value is not None:
+        doc["phash"] = to_hex(phash_value)
+    scan_usage = next((r["usage"] for r in results if r.get("usage")), None)
+    reask_usage = validation.get("reask_usage")
+    if scan_usage and reask_usage:
+        scan_usage = dict(scan_usage)
+        for k in ("input_tokens", "output_tokens", "total_tokens", "cost_usd", "wall_ms"):
+            scan_usage[k] = scan_usage.get(k, 0) + (reask_usage.get(k) or 0)
+    if scan_usage:
+        doc["usage"] = scan_usage
     if not lead_image and structured_json:
         lead_image = structured_json.get("imageUrl") or structured_json.get("image_url")
     if structured_json is not None:
@@ -548,15 +782,30 @@ async def scan_image(
     if lead_image_id:
         doc["preview_image_id"] = lead_image_id
 
-    scans = mongodb.db["scans"]
-    ins = await scans.insert_one(doc)
+    if WRITE_BEHIND_ENABLED:
+        # Respond with a pre-generated id; the document is spooled and batched to
+        # Mongo, and blob references and accounting follow in _after_scan_flush
+        scan_id = await scan_writer.submit(doc)
+    else:
+        scan_id = await insert_scan(doc)
+        try:
+            await record_usage(doc["user_id"], question_id, scan_usage, reused=bool(reused), now=now)
+        except Exception:
+            # Accounting must never fail a scan the user already paid for
+            pass
+        try:
+            await record_scan(doc)
+        except Exception:
+            pass
+    if phash_value is not None:
+        near_duplicates.add(phash_scope, phash_value, {"scan_id": scan_id, "question_id": question_id, "user_id": doc["user_id"]})
 
     payload: Dict[str, Any] = {
         "ok": True,
         "model": OPENAI_MODEL if provider == "openai" else MODEL_NAME,
         "provider": provider,
         "question_id": question_id,
-        "scan_id": str(ins.inserted_id),
+        "scan_id": str(scan_id),
         "raws": raw_responses,
         "results": results,
         "created_at": now.isoformat(),
@@ -571,105 +820,466 @@ async def scan_image(
         payload["structured"] = structured_json
     if lead_image:
         payload["preview_image"] = lead_image
+    if scan_usage:
+        payload["usage"] = scan_usage
+    payload["validation"] = validation
+    try:
+        tts = _speculative_tts(candidate_raw, user_id)
+    except Exception:
+        tts = None
+    if tts:
+        payload["tts"] = tts
+    if reused:
+        payload["reused"] = True
+        if reused["own"]:
+            payload["reused_from"] = str(reused["scan"]["_id"])
+        payload["reuse_distance"] = reused["distance"]
 
-    return JSONResponse(content=payload)
+    return ORJSONResponse(content=payload)
+
+
+def _build_public_url(path: Optional[str]) -> Optional[str]:
+    if not path or not isinstance(path, str):
+        return None
+    trimmed = path.strip()
+    if not trimmed:
+        return None
+    if trimmed.lower().startswith(("http://", "https://", "data:", "blob:", "//")):
+        return trimmed
+    if trimmed.startswith("/"):
+        return f"{IMAGE_PUBLIC_BASE}{trimmed}"
+    return f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{trimmed.lstrip('/')}"
+
+
+def _build_data_url(raw: Optional[str]) -> Optional[str]:
+    if not raw or not isinstance(raw, str):
+        return None
+    stripped = raw.strip()
+    if not stripped:
+        return None
+    if stripped.lower().startswith("data:"):
+        return stripped
+    # best effort: treat as JPEG base64 payload
+    return f"data:image/jpeg;base64,{stripped}"
+
+
+def _scan_list_item(d: Dict[str, Any]) -> Dict[str, Any]:
+    preview_image_url: Optional[str] = None
+    existing_preview = d.get("preview_image")
+    if isinstance(existing_preview, str) and existing_preview.strip():
+        preview_image_url = existing_preview.strip()
+        preview_image_url = _build_public_url(preview_image_url) or _build_data_url(preview_image_url) or preview_image_url
+
+    results = d.get("results") or []
+    preview_image_id = d.get("preview_image_id")
+    if isinstance(results, list) and preview_image_id:
+        match = next((r for r in results if r.get("image_id") == preview_image_id), None)
+        if match:
+            preview_image_url = _build_public_url(match.get("image_url"))
+            if not preview_image_url:
+                preview_image_url = _build_public_url(match.get("image_path"))
+            if not preview_image_url:
+                preview_image_url = _build_data_url(match.get("image_b64") or match.get("image_b64_preview") or match.get("image"))
+    if not preview_image_url and preview_image_id:
+        try:
+            candidate_file = existing_file(preview_image_id)
+        except Exception:
+            candidate_file = None
+        if candidate_file:
+            rel_path = f"{UPLOAD_ROUTE}/{candidate_file.name}"
+            preview_image_url = f"{IMAGE_PUBLIC_BASE}{rel_path}"
+    if not preview_image_url and isinstance(results, list) and results:
+        first = results[0] or {}
+        preview_image_url = _build_public_url(first.get("image_url"))
+        if not preview_image_url:
+            preview_image_url = _build_public_url(first.get("image_path"))
+        if not preview_image_url:
+            preview_image_url = _build_data_url(first.get("image_b64") or first.get("image_b64_preview") or first.get("image"))
+    structured = d.get("structured")
+    if not preview_image_url and isinstance(structured, dict):
+        candidate = structured.get("imageUrl") or structured.get("image_url")
+        preview_image_url = _build_public_url(candidate) or _build_data_url(candidate)
+    return {
+        "id": str(d.get("_id")),
+        "question_id": d.get("question_id"),
+        "model": d.get("model"),
+        "images_count": d.get("images_count", 0),
+        "title": d.get("title"),
+        "risk_level": d.get("risk_level"),
+        "created_at": d.get("created_at"),
+        "preview_image": preview_image_url,
+    }
 
 
 @app.get("/api/scans")
-async def list_scans(authorization: Optional[str] = Header(default=None)) -> JSONResponse:
+async def list_scans(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
     claims = parse_authorization(authorization)
     user_id = claims.get("sub")
     scans = mongodb.db["scans"]
-    cursor = scans.find({"user_id": ObjectId(user_id)}).sort("created_at", -1).limit(50)
+    # Legacy (unmigrated) documents may still carry the heavy fields inline
+    cursor = scans.find({"user_id": ObjectId(user_id)}, LIST_PROJECTION).sort("created_at", -1).limit(50)
     items: List[Dict[str, Any]] = []
     async for d in cursor:
-        preview_image_url: Optional[str] = None
-
-        def _build_public_url(path: Optional[str]) -> Optional[str]:
-            if not path or not isinstance(path, str):
-                return None
-            trimmed = path.strip()
-            if not trimmed:
-                return None
-            if trimmed.lower().startswith(("http://", "https://", "data:", "blob:", "//")):
-                return trimmed
-            if trimmed.startswith("/"):
-                return f"{IMAGE_PUBLIC_BASE}{trimmed}"
-            return f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{trimmed.lstrip('/')}"
-
-        def _build_data_url(raw: Optional[str]) -> Optional[str]:
-            if not raw or not isinstance(raw, str):
-                return None
-            stripped = raw.strip()
-            if not stripped:
-                return None
-            if stripped.lower().startswith("data:"):
-                return stripped
-            # best effort: treat as JPEG base64 payload
-            return f"data:image/jpeg;base64,{stripped}"
-
-        existing_preview = d.get("preview_image")
-        if isinstance(existing_preview, str) and existing_preview.strip():
-            preview_image_url = existing_preview.strip()
-            preview_image_url = _build_public_url(preview_image_url) or _build_data_url(preview_image_url) or preview_image_url
-
-        results = d.get("results") or []
-        preview_image_id = d.get("preview_image_id")
-        if isinstance(results, list) and preview_image_id:
-            match = next((r for r in results if r.get("image_id") == preview_image_id), None)
-            if match:
-                preview_image_url = _build_public_url(match.get("image_url"))
-                if not preview_image_url:
-                    preview_image_url = _build_public_url(match.get("image_path"))
-                if not preview_image_url:
-                    preview_image_url = _build_data_url(match.get("image_b64") or match.get("image_b64_preview") or match.get("image"))
-        if not preview_image_url and preview_image_id:
-            try:
-                candidate_file = next((p for p in UPLOAD_ROOT.glob(f"{preview_image_id}.*")), None)
-            except Exception:
-                candidate_file = None
-            if candidate_file:
-                rel_path = f"{UPLOAD_ROUTE}/{candidate_file.name}"
-                preview_image_url = f"{IMAGE_PUBLIC_BASE}{rel_path}"
-        if not preview_image_url and isinstance(results, list) and results:
-            first = results[0] or {}
-            preview_image_url = _build_public_url(first.get("image_url"))
-            if not preview_image_url:
-                preview_image_url = _build_public_url(first.get("image_path"))
-            if not preview_image_url:
-                preview_image_url = _build_data_url(first.get("image_b64") or first.get("image_b64_preview") or first.get("image"))
-        structured = d.get("structured")
-        if not preview_image_url and isinstance(structured, dict):
-            candidate = structured.get("imageUrl") or structured.get("image_url")
-            preview_image_url = _build_public_url(candidate) or _build_data_url(candidate)
-        items.append({
-            "id": str(d.get("_id")),
-            "question_id": d.get("question_id"),
-            "model": d.get("model"),
-            "images_count": d.get("images_count", 0),
-            "created_at": d.get("created_at").isoformat() if d.get("created_at") else None,
-            "preview_image": preview_image_url,
-        })
-    return JSONResponse({"ok": True, "items": items})
+        items.append(_scan_list_item(d))
+    return ORJSONResponse({"ok": True, "items": items})
+
+
+@app.get("/api/scans/search")
+async def search_scans_endpoint(
+    q: Optional[str] = None,
+    risk_level: Optional[str] = None,
+    survey_level: Optional[int] = None,
+    postcode: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    facets: bool = False,
+    authorization: Optional[str] = Header(default=None),
+) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    user_id = claims.get("sub")
+    try:
+        query = build_query(ObjectId(user_id), q, risk_level, survey_level, postcode, date_from, date_to)
+        page = await search_scans(query, limit, cursor, facets)
+    except ValueError as e:
+        return ORJSONResponse(status_code=400, content={"ok": False, "error": str(e)})
+    content: Dict[str, Any] = {
+        "ok": True,
+        "items": [_scan_list_item(d) for d in page["docs"]],
+        "next_cursor": page["next_cursor"],
+    }
+    if "facets" in page:
+        content["facets"] = page["facets"]
+    return ORJSONResponse(content)
+
+
+@app.post("/api/scans/export/token")
+async def export_token(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    # For plain download links: ?token= takes this short-lived token, never the session JWT
+    issued = create_download_token(authorization, "scans_export")
+    return ORJSONResponse({"ok": True, **issued})
+
+
+@app.get("/api/scans/export")
+async def export_scans(
+    format: str = "jsonl",
+    gzip: bool = False,
+    include_raw: bool = False,
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    risk_level: Optional[str] = None,
+    survey_level: Optional[int] = None,
+    postcode: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    token: Optional[str] = None,
+    authorization: Optional[str] = Header(default=None),
+) -> Response:
+    # ?token= lets a plain download link authenticate with a token from /api/scans/export/token
+    claims = parse_download_token(token, "scans_export") if token else parse_authorization(authorization)
+    user_id = claims.get("sub")
+    if format not in EXPORT_FORMATS:
+        return ORJSONResponse(status_code=400, content={"ok": False, "error": f"format must be one of {', '.join(EXPORT_FORMATS)}"})
+    try:
+        query = build_query(ObjectId(user_id), q, risk_level, survey_level, postcode, date_from, date_to)
+        stream = export_stream(query, format, _build_public_url, cursor=cursor, gzip=gzip, include_raw=include_raw)
+    except ValueError as e:
+        return ORJSONResponse(status_code=400, content={"ok": False, "error": str(e)})
+    compressed = gzip and format != "zip"
+    filename = export_filename(format, gzip, time.strftime("%Y%m%d-%H%M%S"))
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip" if compressed else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
 
 
 @app.get("/api/scans/{scan_id}")
-async def get_scan(scan_id: str, authorization: Optional[str] = Header(default=None)) -> JSONResponse:
+async def get_scan(scan_id: str, full: bool = True, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
     claims = parse_authorization(authorization)
     user_id = claims.get("sub")
-    scans = mongodb.db["scans"]
-    d = await scans.find_one({"_id": ObjectId(scan_id), "user_id": ObjectId(user_id)})
+    # Raw responses and the structured payload are loaded from scan_payloads only when full=true
+    d = await load_scan({"_id": ObjectId(scan_id), "user_id": ObjectId(user_id)}, full=full)
+    if not d and WRITE_BEHIND_ENABLED:
+        pending = scan_writer.pending(ObjectId(scan_id))
+        if pending and pending.get("user_id") == ObjectId(user_id):
+            d = dict(pending)
     if not d:
-        return JSONResponse(status_code=404, content={"ok": False, "error": "Not found"})
-    d["id"] = str(d.pop("_id"))
-    d["user_id"] = str(d.get("user_id"))
-    if d.get("created_at"):
-        try:
-            d["created_at"] = d["created_at"].isoformat()
-        except Exception:
-            d["created_at"] = str(d["created_at"])
+        return ORJSONResponse(status_code=404, content={"ok": False, "error": "Not found"})
+    # ObjectId and datetime values are serialized by ORJSONResponse
+    d["id"] = d.pop("_id")
     for r in d.get("results", []):
         if "image_path" in r:
             if not r.get("image_url"):
                 r["image_url"] = f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{r['image_path']}"
-    return JSONResponse({"ok": True, "scan": d})
+    return ORJSONResponse({"ok": True, "scan": d})
+
+
+@app.get("/api/admin/storage")
+async def admin_storage(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, "storage": await storage_stats()})
+
+
+@app.get("/api/admin/gc")
+async def admin_gc_status(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, "gc": await gc_status()})
+
+
+@app.post("/api/admin/gc")
+async def admin_gc_run(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, "report": await collect_orphans()})
+
+
+@app.get("/api/admin/usage")
+async def admin_usage(user_id: Optional[str] = None, days: int = 30, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, "usage": await usage_report(user_id, days)})
+
+
+@app.get("/api/admin/upstream")
+async def admin_upstream(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, **upstream.stats.snapshot()})
+
+
+@app.get("/api/admin/cache")
+async def admin_cache(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    return ORJSONResponse({"ok": True, "caches": cache_stats()})
+
+
+@app.get("/api/admin/analytics")
+async def admin_analytics(days: int = 30, dim: str = "all", key: Optional[str] = None, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    if (claims or {}).get("role") not in ("admin",):
+        return ORJSONResponse(status_code=403, content={"ok": False, "error": "Admin only"})
+    if dim not in DIMENSIONS:
+        return ORJSONResponse(status_code=400, content={"ok": False, "error": f"dim must be one of {', '.join(DIMENSIONS)}"})
+    return ORJSONResponse({"ok": True, "analytics": await dashboard(days, dim, key)})
+
+
+# ------------------ Live survey sessions (WebSocket) ------------------
+# Protocol: connect to /api/survey/ws?token=<jwt> (or with an Authorization header).
+#   -> {"type": "start", "survey_id"?, "question_id"?, "provider"?, "model"?, "property"?, "survey_level"?}
+#   <- {"type": "session", "survey_id", "summary"}
+#   -> binary frame: one photo          <- {"type": "accepted", "seq"}
+#                                       <- {"type": "result", "seq", "photo", "summary"} (as each completes)
+#   -> {"type": "finish"}               <- {"type": "complete", "survey_id", "summary"}, then close
+async def _analyze_survey_photo(contents: bytes, seq: int, opts: Dict[str, Any], user_id: Optional[str], survey: Dict[str, Any]) -> Dict[str, Any]:
+    question_id = opts["question_id"]
+    prompt, schema = resolve_prompt(question_id, opts["provider"])
+    resp, used_model = await call_provider(opts["provider"], prompt, [contents], opts.get("model"), schema=schema)
+    stored = await store_image(contents, None)
+    raw = resp.get("response", "")
+    structured, validation = validate_structured(question_id, _extract_structured_json(raw))
+    image_url = f"{IMAGE_PUBLIC_BASE}{UPLOAD_ROUTE}/{stored['filename']}"
+    if isinstance(structured, dict) and not structured.get("imageUrl"):
+        structured["imageUrl"] = image_url
+    now = __import__("datetime").datetime.utcnow()
+    photo: Dict[str, Any] = {
+        "seq": seq,
+        "image_id": stored["hash"],
+        "image_path": stored["filename"],
+        "image_url": image_url,
+        "model": used_model,
+        "response": raw,
+        "structured": structured,
+        "validation": validation,
+        "usage": resp.get("usage"),
+        "created_at": now,
+    }
+    # Each photo is a scan of its own; the survey document only references it
+    doc: Dict[str, Any] = {
+        "_id": ObjectId(),
+        "user_id": ObjectId(user_id) if user_id else None,
+        "question_id": question_id,
+        "model": used_model,
+        "provider": opts["provider"],
+        "results": [{"image_id": stored["hash"], "image_path": stored["filename"], "image_url": image_url, "response": raw}],
+        "images_count": 1,
+        "preview_image_id": stored["hash"],
+        "created_at": now,
+        "source": "survey",
+        "survey_id": survey["_id"],
+        "validation": validation,
+    }
+    for field in ("property", "survey", "expire_at"):
+        if survey.get(field):
+            doc[field] = survey[field]
+    if structured is not None:
+        doc["structured"] = structured
+    if raw:
+        doc["raw_text"] = raw
+    if resp.get("usage"):
+        doc["usage"] = resp["usage"]
+    try:
+        photo["scan_id"] = await insert_scan(doc)
+        await record_scan(doc)
+    except Exception as e:
+        # The client still gets the result; the survey keeps the photo without a scan_id
+        photo["save_error"] = str(e)[:300]
+    try:
+        await record_usage(ObjectId(user_id) if user_id else None, question_id, resp.get("usage"))
+    except Exception:
+        pass
+    return photo
+
+
+@app.post("/api/survey/ws/token")
+async def survey_ws_token(authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    # Browsers cannot set headers on a websocket; ?token= takes this short-lived token, never the session JWT
+    issued = create_download_token(authorization, "survey_ws")
+    return ORJSONResponse({"ok": True, **issued})
+
+
+@app.websocket("/api/survey/ws")
+async def survey_ws(websocket: WebSocket, token: Optional[str] = None) -> None:
+    try:
+        if token:
+            claims = parse_download_token(token, "survey_ws")
+        else:
+            claims = parse_authorization(websocket.headers.get("authorization"))
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    user_id = claims.get("sub")
+    await websocket.accept()
+
+    async def send(msg: Dict[str, Any]) -> None:
+        try:
+            await websocket.send_text(orjson_dumps(msg).decode("utf-8"))
+        except Exception:
+            # Client went away; analyses keep running and are still persisted
+            pass
+
+    opts: Dict[str, Any] = {"question_id": "rics_single_image", "provider": "openai", "model": None}
+    survey: Optional[Dict[str, Any]] = None
+    summary = SurveySummary()
+    sem = asyncio.Semaphore(SURVEY_WS_CONCURRENCY)
+    # Backpressure: once this many photos are buffered, stop reading frames until one finishes
+    inflight = asyncio.Semaphore(SURVEY_WS_MAX_INFLIGHT)
+    tasks: Set[asyncio.Task] = set()
+    seq = 0
+
+    async def ensure_survey() -> Dict[str, Any]:
+        nonlocal survey, summary, seq
+        if survey is None:
+            survey = await open_survey(user_id, opts, expiry_for(claims.get("role"), __import__("datetime").datetime.utcnow()))
+            summary = SurveySummary(survey.get("summary"))
+            # A resumed survey continues its numbering
+            seq = max((p.get("seq") or 0 for p in survey.get("photos") or []), default=0)
+            await send({"type": "session", "survey_id": str(survey["_id"]), "summary": summary.to_doc()})
+        return survey
+
+    async def process(n: int, contents: bytes) -> None:
+        try:
+            async with sem:
+                try:
+                    over = await budget_exceeded(ObjectId(user_id) if user_id else None, claims.get("role"))
+                    if over:
+                        photo: Dict[str, Any] = {"seq": n, "error": "Daily token budget exceeded"}
+                    else:
+                        photo = await _analyze_survey_photo(contents, n, opts, user_id, survey)
+                except Exception as e:
+                    photo = {"seq": n, "error": f"Failed to query provider: {e}"}
+        finally:
+            del contents
+            inflight.release()
+        summary.add(photo)
+        try:
+            await add_photo(survey["_id"], photo, summary)
+        except Exception:
+            pass
+        await send({"type": "result", "seq": n, "photo": photo, "summary": summary.to_doc()})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                contents = message["bytes"]
+                if not contents or len(contents) > SURVEY_MAX_PHOTO_BYTES:
+                    await send({"type": "error", "error": "Empty or oversized photo"})
+                    continue
+                if survey is None:
+                    try:
+                        await ensure_survey()
+                    except Exception as e:
+                        await send({"type": "error", "error": f"Could not open survey: {e}"})
+                        continue
+                await inflight.acquire()
+                seq += 1
+                await send({"type": "accepted", "seq": seq})
+                task = asyncio.create_task(process(seq, contents))
+                del contents
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                continue
+            try:
+                data = json.loads(message.get("text") or "{}")
+            except ValueError:
+                await send({"type": "error", "error": "Invalid JSON"})
+                continue
+            kind = data.get("type")
+            if kind == "start" and survey is None:
+                if data.get("question_id") in QUESTIONS:
+                    opts["question_id"] = data["question_id"]
+                opts["provider"] = (data.get("provider") or opts["provider"]).lower()
+                opts["model"] = data.get("model")
+                opts["property"] = data.get("property") or None
+                opts["survey_level"] = data.get("survey_level")
+                opts["survey_id"] = data.get("survey_id")
+                try:
+                    await ensure_survey()
+                except Exception as e:
+                    # e.g. a malformed survey_id; the client may send another start
+                    await send({"type": "error", "error": f"Could not open survey: {e}"})
+            elif kind == "finish":
+                if survey is None:
+                    try:
+                        await ensure_survey()
+                    except Exception as e:
+                        await send({"type": "error", "error": f"Could not open survey: {e}"})
+                        continue
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                try:
+                    await close_survey(survey["_id"], summary)
+                except Exception as e:
+                    # Photos are already saved; the survey just stays open
+                    await send({"type": "error", "error": f"Could not close survey: {e}"})
+                await send({"type": "complete", "survey_id": str(survey["_id"]), "summary": summary.to_doc()})
+                await websocket.close()
+                return
+            elif kind == "ping":
+                await send({"type": "pong"})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/surveys/{survey_id}")
+async def get_survey(survey_id: str, authorization: Optional[str] = Header(default=None)) -> ORJSONResponse:
+    claims = parse_authorization(authorization)
+    user_id = claims.get("sub")
+    d = await mongodb.db["surveys"].find_one({"_id": ObjectId(survey_id), "user_id": ObjectId(user_id)})
+    if not d:
+        return ORJSONResponse(status_code=404, content={"ok": False, "error": "Not found"})
+    d["id"] = d.pop("_id")
+    return ORJSONResponse({"ok": True, "survey": d})
@@ -0,0 +1,91 @@
+"""Check peak memory of building and sending provider request bodies.
+
+Usage:
+    python payload_bench.py [--mb 10] [--max-ratio 1.5]
+
+For an image of ``--mb`` megabytes, measures with tracemalloc the peak memory
+of one request: the upload bytes plus everything needed to produce the body.
+The old path (base64 ``str``, data URI f-string, payload dict, ``json.dumps``)
+is shown for comparison. Exits 1 when the streamed ``payloads.JSONBody`` path
+peaks above ``--max-ratio`` x the image size, so it can run as a check.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tracemalloc
+from typing import Callable, List, Optional
+
+from payloads import ollama_body, openai_body
+
+
+def _old_openai(contents: bytes) -> int:
+    b64 = base64.b64encode(contents).decode("utf-8")
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "Describe"},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
+        ]}],
+    }
+    return len(json.dumps(payload).encode("utf-8"))
+
+
+def _old_ollama(contents: bytes) -> int:
+    payload = {"model": "llava:7b", "prompt": "Describe", "images": [base64.b64encode(contents).decode("utf-8")], "stream": False}
+    return len(json.dumps(payload).encode("utf-8"))
+
+
+def _drain(body) -> int:
+    async def run() -> int:
+        sent = 0
+        async for chunk in body:
+            sent += len(chunk)
+        return sent
+
+    return asyncio.run(run())
+
+
+def _new_openai(contents: bytes) -> int:
+    return _drain(openai_body("gpt-4o-mini", "Describe", [contents]))
+
+
+def _new_ollama(contents: bytes) -> int:
+    return _drain(ollama_body("llava:7b", "Describe", [contents]))
+
+
+def _peak(size: int, fn: Callable[[bytes], int]) -> int:
+    """Peak traced bytes for one request, the upload itself included."""
+    tracemalloc.start()
+    try:
+        contents = os.urandom(size)
+        fn(contents)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Peak memory of provider request bodies per image.")
+    ap.add_argument("--mb", type=float, default=10)
+    ap.add_argument("--max-ratio", type=float, default=1.5, help="allowed peak / image size for the streamed path")
+    args = ap.parse_args(argv)
+
+    size = int(args.mb * 1024 * 1024)
+    failed = False
+    print(f"image={size / 1e6:.1f} MB  limit={args.max_ratio:.2f}x")
+    for name, old, new in (("openai", _old_openai, _new_openai), ("ollama", _old_ollama, _new_ollama)):
+        old_peak, new_peak = _peak(size, old), _peak(size, new)
+        ok = new_peak <= args.max_ratio * size
+        failed |= not ok
+        print(f"{name:7} old {old_peak / 1e6:7.1f} MB ({old_peak / size:4.2f}x)  "
+              f"streamed {new_peak / 1e6:7.1f} MB ({new_peak / size:4.2f}x)  {'ok' if ok else 'OVER LIMIT'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import base64
+import json
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+
+# Provider request bodies are assembled as a list of JSON byte fragments and
+# image placeholders. Images are base64-encoded chunk by chunk while httpx sends
+# the body, so a request never holds more than the raw upload plus one chunk —
+# no base64 `str`, no payload dict copy and no JSON-encoded copy of the image.
+B64_CHUNK = 3 * 64 * 1024  # multiple of 3 so chunks concatenate into valid base64
+
+
+_B64_RE = re.compile(rb"[A-Za-z0-9+/]*={0,2}")
+
+
+class InvalidBase64(ValueError):
+    """A client-supplied image string is not plain base64."""
+
+
+class Base64Data:
+    """Placeholder for a base64 JSON string value, optionally behind a prefix (data URI)."""
+
+    __slots__ = ("data", "encoded", "prefix")
+
+    def __init__(self, data: Union[bytes, str], prefix: str = "") -> None:
+        self.prefix = prefix.encode("ascii")
+        self.data: Optional[bytes] = None
+        self.encoded: Optional[bytes] = None
+        if isinstance(data, str):
+            # Already base64 (client input): validated here because it is written
+            # into the JSON body verbatim, without escaping
+            encoded = data.encode("utf-8").translate(None, b" \t\r\n")
+            if len(encoded) % 4 or not _B64_RE.fullmatch(encoded):
+                raise InvalidBase64("image must be base64-encoded")
+            self.encoded = encoded
+        else:
+            self.data = data
+
+    def __len__(self) -> int:
+        if self.encoded is not None:
+            return len(self.prefix) + len(self.encoded)
+        return len(self.prefix) + 4 * ((len(self.data) + 2) // 3)
+
+    def chunks(self):
+        if self.prefix:
+            yield self.prefix
+        if self.encoded is not None:
+            yield self.encoded
+            return
+        view = memoryview(self.data)
+        for i in range(0, len(view), B64_CHUNK):
+            yield base64.b64encode(view[i:i + B64_CHUNK])
+
+
+Part = Union[bytes, Base64Data]
+
+
+def _encode(obj: Any, parts: List[Part]) -> None:
+    if isinstance(obj, Base64Data):
+        parts.extend((b'"', obj, b'"'))
+    elif isinstance(obj, dict):
+        parts.append(b"{")
+        for i, (k, v) in enumerate(obj.items()):
+            if i:
+                parts.append(b",")
+            parts.append(json.dumps(str(k)).encode("utf-8") + b":")
+            _encode(v, parts)
+        parts.append(b"}")
+    elif isinstance(obj, (list, tuple)):
+        parts.append(b"[")
+        for i, v in enumerate(obj):
+            if i:
+                parts.append(b",")
+            _encode(v, parts)
+        parts.append(b"]")
+    else:
+        parts.append(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+class JSONBody:
+    """Streamable JSON request body; iterate it (any number of times) to send."""
+
+    def __init__(self, obj: Any) -> None:
+        raw: List[Part] = []
+        _encode(obj, raw)
+        # Merge adjacent literal fragments to keep the number of writes low
+        self.parts: List[Part] = []
+        for p in raw:
+            if isinstance(p, bytes) and self.parts and isinstance(self.parts[-1], bytes):
+                self.parts[-1] += p
+            else:
+                self.parts.append(p)
+        self.length = sum(len(p) for p in self.parts)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", "Content-Length": str(self.length)}
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for p in self.parts:
+            if isinstance(p, Base64Data):
+                for chunk in p.chunks():
+                    yield chunk
+            else:
+                yield p
+
+
+def ollama_body(model: str, prompt: str, images: List[Union[bytes, str]], schema: Optional[Dict[str, Any]] = None) -> JSONBody:
+    body: Dict[str, Any] = {
+        "model": model,
+        "prompt": prompt,
+        "images": [Base64Data(img) for img in images],
+        "stream": False,
+    }
+    if schema is not None:
+        # Ollama structured outputs: constrain generation to the JSON schema
+        body["format"] = schema
+    return JSONBody(body)
+
+
+def openai_body(model: str, prompt: str, images: List[Union[bytes, str]], schema: Optional[Dict[str, Any]] = None, schema_name: str = "analysis", **extra: Any) -> JSONBody:
+    # Build vision message: text + image URLs (data URIs)
+    content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
+    for img in images:
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": Base64Data(img, prefix="data:image/jpeg;base64,")},
+        })
+    body: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "temperature": 0.2,
+        **extra,
+    }
+    if schema is not None:
+        body["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+        }
+    return JSONBody(body)
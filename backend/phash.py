@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import io
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+from db import mongodb
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:
+    Image = None  # type: ignore
+
+
+# Perceptual near-duplicate detection. Every stored image gets a 64-bit dHash;
+# recent hashes are kept per scope (a user, or a property) in a BK-tree so that
+# "anything within N bits" lookups stay cheap. Scans of near-identical photos can
+# then reuse an earlier analysis instead of calling the model again.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_LOOKBACK_DAYS = int(os.getenv("PHASH_LOOKBACK_DAYS", "90"))
+PHASH_REUSE_DEFAULT = os.getenv("PHASH_REUSE_DEFAULT", "false").lower() in ("1", "true", "yes")
+PHASH_MAX_SCOPES = int(os.getenv("PHASH_MAX_SCOPES", "1000"))
+PHASH_SCOPE_TTL = int(os.getenv("PHASH_SCOPE_TTL", "600"))
+PHASH_SCOPE = os.getenv("PHASH_SCOPE", "user").lower()
+
+
+def dhash(contents: bytes, size: int = 8) -> Optional[int]:
+    """64-bit difference hash of an image, or None when Pillow is unavailable or decoding fails."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(contents)) as im:
+            im.draft("L", (size * 4, size * 4))  # cheap JPEG downscale while decoding
+            gray = im.convert("L").resize((size + 1, size), Image.LANCZOS)
+            px = list(gray.getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (px[base + col] > px[base + col + 1])
+    return value
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance."""
+
+    def __init__(self) -> None:
+        # node: (hash, item, {distance: child})
+        self._root: Optional[Tuple[int, Any, Dict[int, Any]]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: Any) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        found: List[Tuple[int, Any]] = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= max_distance:
+                found.append((d, node[1]))
+            for k, child in node[2].items():
+                if d - max_distance <= k <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+def scope_for(user_id: Any, prop: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Mongo filter selecting the scans a new image may be matched against.
+
+    PHASH_SCOPE=property matches across users on the same postcode (or address);
+    it falls back to the user's own scans when no property is given.
+    """
+    prop = prop or {}
+    if PHASH_SCOPE == "property":
+        if prop.get("postcode"):
+            return {"property.postcode": prop["postcode"]}
+        if prop.get("address"):
+            return {"property.address": prop["address"]}
+    return {"user_id": ObjectId(user_id) if user_id else None}
+
+
+class NearDuplicateIndex:
+    """Per-scope BK-trees of recent scan hashes, loaded lazily from `scans`."""
+
+    def __init__(self, max_scopes: int = PHASH_MAX_SCOPES, ttl: int = PHASH_SCOPE_TTL) -> None:
+        self.max_scopes = max_scopes
+        self.ttl = ttl
+        self._trees: "OrderedDict[str, Tuple[float, BKTree]]" = OrderedDict()
+
+    @staticmethod
+    def _key(scope: Dict[str, Any]) -> str:
+        return repr(sorted(scope.items()))
+
+    async def _tree(self, scope: Dict[str, Any]) -> BKTree:
+        key = self._key(scope)
+        hit = self._trees.get(key)
+        if hit and time.monotonic() - hit[0] < self.ttl:
+            self._trees.move_to_end(key)
+            return hit[1]
+        tree = BKTree()
+        since = datetime.utcnow() - timedelta(days=PHASH_LOOKBACK_DAYS)
+        query = {**scope, "phash": {"$exists": True}, "created_at": {"$gte": since}}
+        projection = {"phash": 1, "question_id": 1, "user_id": 1}
+        async for d in mongodb.db["scans"].find(query, projection):
+            try:
+                tree.add(int(d["phash"], 16), {"scan_id": d["_id"], "question_id": d.get("question_id"), "user_id": d.get("user_id")})
+            except (TypeError, ValueError):
+                continue
+        self._trees[key] = (time.monotonic(), tree)
+        self._trees.move_to_end(key)
+        while len(self._trees) > self.max_scopes:
+            self._trees.popitem(last=False)
+        return tree
+
+    async def find(self, scope: Dict[str, Any], value: int, question_id: str, max_distance: int = PHASH_MAX_DISTANCE) -> Optional[Tuple[int, Dict[str, Any]]]:
+        tree = await self._tree(scope)
+        for d, item in tree.search(value, max_distance):
+            if item.get("question_id") == question_id:
+                return d, item
+        return None
+
+    def add(self, scope: Dict[str, Any], value: int, item: Dict[str, Any]) -> None:
+        hit = self._trees.get(self._key(scope))
+        if hit:
+            hit[1].add(value, item)
+
+
+near_duplicates = NearDuplicateIndex()
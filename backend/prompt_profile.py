@@ -0,0 +1,101 @@
+"""Measure the size and prefill cost of each prompt in prompts.QUESTIONS.
+
+Usage:
+    python prompt_profile.py                       # offline token estimates
+    python prompt_profile.py --provider ollama     # real calls, reports prefill time
+    python prompt_profile.py --provider openai --image sample.jpg --runs 3
+
+Every question is profiled in each available variant ("inline" template vs.
+compact prompt + provider-side JSON schema), per provider: OpenAI bills the
+schema (``response_format``) as input, Ollama's ``format`` is not prompt text.
+Without --provider nothing leaves the machine and both providers are listed:
+token counts come from tiktoken when installed, otherwise from a ~4 characters
+per token estimate.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from prompts import COMPACT_QUESTIONS, PROMPT_VARIANTS, QUESTIONS, resolve_prompt
+
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None  # type: ignore
+
+
+def count_tokens(text: str) -> Dict[str, Any]:
+    if tiktoken is not None:
+        enc = tiktoken.get_encoding("o200k_base")
+        return {"tokens": len(enc.encode(text)), "exact": True}
+    return {"tokens": max(1, round(len(text) / 4)), "exact": False}
+
+
+def _variants(question_id: str) -> List[str]:
+    return [v for v in PROMPT_VARIANTS if v == "inline" or question_id in COMPACT_QUESTIONS]
+
+
+async def _measure(provider: str, model: Optional[str], prompt: str, schema: Optional[Dict[str, Any]], images: List[bytes], runs: int) -> Dict[str, Any]:
+    from main import call_provider
+
+    prefill: List[float] = []
+    input_tokens = 0
+    for _ in range(runs):
+        resp, _ = await call_provider(provider, prompt, images, model, schema=schema)
+        usage = resp.get("usage") or {}
+        input_tokens = usage.get("input_tokens") or input_tokens
+        # Ollama reports prefill directly; for OpenAI wall time is the closest proxy
+        prefill.append(float(usage.get("prefill_ms") or usage.get("wall_ms") or 0.0))
+    return {
+        "provider_input_tokens": input_tokens,
+        "prefill_ms_median": round(statistics.median(prefill), 1) if prefill else None,
+    }
+
+
+async def profile(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    images = [Path(args.image).read_bytes()] if args.image else []
+    rows: List[Dict[str, Any]] = []
+    for provider in [args.provider] if args.provider else ["openai", "ollama"]:
+        for qid in QUESTIONS:
+            for variant in _variants(qid):
+                prompt, schema = resolve_prompt(qid, provider, variant)
+                # OpenAI counts the response_format schema as input tokens; Ollama's format does not
+                sent = prompt + (json.dumps(schema, separators=(",", ":")) if schema and provider == "openai" else "")
+                row: Dict[str, Any] = {"provider": provider, "question_id": qid, "variant": variant, "chars": len(sent), **count_tokens(sent)}
+                if args.provider:
+                    row.update(await _measure(args.provider, args.model, prompt, schema, images, args.runs))
+                rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Profile prompt size and prefill cost per question and variant.")
+    ap.add_argument("--provider", choices=["ollama", "openai"], default=None, help="measure against a real provider")
+    ap.add_argument("--model", default=None)
+    ap.add_argument("--image", default=None, help="image to attach to measured calls")
+    ap.add_argument("--runs", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = ap.parse_args(argv)
+
+    rows = asyncio.run(profile(args))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return 0
+    cols = ["provider", "question_id", "variant", "chars", "tokens", "provider_input_tokens", "prefill_ms_median"]
+    cols = [c for c in cols if any(c in r for r in rows)]
+    print("\t".join(cols))
+    for r in rows:
+        print("\t".join(str(r.get(c, "")) for c in cols))
+    if tiktoken is None:
+        print("(token counts estimated; install tiktoken for exact counts)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Dict
+import os
+from typing import Any, Dict, Optional, Tuple
 
 
 # Central place to manage question prompts used by the analysis endpoints.
@@ -66,3 +67,86 @@ QUESTIONS: Dict[str, str] = {
         "act as uk rics property surveyor l1 l2 and l3 and tell me about the each image as i will be buying this house so before placing an offer."
     ),
 }
+
+
+# ------------------ Compact prompt variants ------------------
+# The "inline" variant is QUESTIONS above: the JSON template travels inside the
+# prompt on every call. The "schema" variant sends a short instruction and hands
+# the shape to the provider as a JSON schema (OpenAI `response_format`, Ollama
+# `format`). For Ollama the schema constrains decoding and is not prompt text, so
+# the prompt shrinks; OpenAI bills the schema as input, so there the gain is a
+# guaranteed shape rather than fewer tokens. Fields the server fills itself
+# (`id`, `address`, `imageUrl`) are left out of the schemas.
+def _obj(props: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+
+
+_STR = {"type": "string"}
+_NUM = {"type": "number"}
+_STR_LIST = {"type": "array", "items": _STR}
+_COST_LIST = {"type": "array", "items": _obj({"item": _STR, "min": _NUM, "max": _NUM})}
+
+_ANALYZE_SCHEMA = _obj({
+    "title": _STR,
+    "summary": _STR,
+    "findings": _STR_LIST,
+    "recommended_actions": _STR_LIST,
+    "risk_level": {"type": "string", "enum": ["low", "moderate", "high"]},
+    "keywords": _STR_LIST,
+})
+
+RESPONSE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "rics_analyze": _ANALYZE_SCHEMA,
+    "general": _ANALYZE_SCHEMA,
+    "rics_single_image": _obj({
+        "title": _STR,
+        "verdict": _obj({"condition": _STR, "risk": _STR, "stance": _STR}),
+        "highlights": _STR_LIST,
+        "likelyCauses": _STR_LIST,
+        "level1": _obj({
+            "ratings": {"type": "array", "items": _obj({"element": _STR, "rating": _NUM, "note": _STR})},
+            "advice": _STR,
+        }),
+        "level2": _obj({"investigations": _STR_LIST, "remediation": _STR_LIST}),
+        "level3": _obj({"intrusive": _STR_LIST, "risks": _STR_LIST, "heavyCosts": _COST_LIST}),
+        "costs": _COST_LIST,
+        "checklist": _STR_LIST,
+        "allowance": _STR,
+    }),
+}
+
+COMPACT_QUESTIONS: Dict[str, str] = {
+    "rics_analyze": (
+        "Act as a UK RICS residential surveyor. From the image(s), identify visible defects (e.g., damp, mould, cracking, leaks, roof or "
+        "joinery issues). Give concise findings and solutions aligned with RICS guidance. Respond as JSON "
+        "matching the provided schema; keep the language clear and professional."
+    ),
+    "general": (
+        "You are a building pathology assistant. Extract visible issues and suggest practical next steps. "
+        "Respond as JSON matching the provided schema."
+    ),
+    "rics_single_image": (
+        "Act as a UK RICS residential surveyor. From this single image of a property area/room, identify visible defects (damp, mould, "
+        "cracking, leaks, roof, joinery, finishes, services) and give concise remedial actions aligned with the "
+        "RICS Home Survey Standard. Where relevant, comment briefly on habitability and whether the issues could "
+        "support a price negotiation (no monetary figure). level1.ratings has three entries. Respond as JSON "
+        "matching the provided schema, in a clear, objective, professional tone."
+    ),
+}
+
+PROMPT_VARIANTS = ("inline", "schema")
+
+
+def prompt_variant(provider: str) -> str:
+    """Configured variant for a provider: PROMPT_VARIANT_<PROVIDER>, then PROMPT_VARIANT."""
+    value = os.getenv(f"PROMPT_VARIANT_{(provider or '').upper()}") or os.getenv("PROMPT_VARIANT", "inline")
+    value = value.lower()
+    return value if value in PROMPT_VARIANTS else "inline"
+
+
+def resolve_prompt(question_id: str, provider: str, variant: Optional[str] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Return ``(prompt, json_schema)`` for a question; the schema is None for inline prompts."""
+    variant = variant or prompt_variant(provider)
+    if variant == "schema" and question_id in COMPACT_QUESTIONS and question_id in RESPONSE_SCHEMAS:
+        return COMPACT_QUESTIONS[question_id], RESPONSE_SCHEMAS[question_id]
+    return QUESTIONS[question_id], None
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import base64
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(obj: Any) -> Any:
+    # datetime, UUID and dataclasses are handled natively by orjson
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(obj)).decode("ascii")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson; understands ObjectId, datetime and bytes."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
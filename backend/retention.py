@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import env  # noqa: F401  (loads .env when run as a script)
+from db import mongodb
+from storage import UPLOAD_ROOT
+
+
+# Retention: each scan gets an `expire_at` derived from the owner's role and a TTL
+# index on `scans` / `scan_payloads` removes it once that time has passed. 0 keeps
+# scans forever. Per-role overrides: SCAN_RETENTION_DAYS_USER, _ITN, _ADMIN, ...
+DEFAULT_RETENTION_DAYS = int(os.getenv("SCAN_RETENTION_DAYS", "0"))
+
+# Orphan-image collector: walks the `blobs` collection, a bounded number per
+# second, resets refcounts to the real reference count and deletes files that
+# no scan references and that were not used within the grace period.
+# Each pass first walks the upload store one filename-prefix shard per run and
+# registers files without a blob document (written while Mongo was down, or for
+# a scan that was never inserted), so those are collected too.
+GC_INTERVAL_SECONDS = int(os.getenv("GC_INTERVAL_SECONDS", "0"))
+GC_GRACE_HOURS = float(os.getenv("GC_GRACE_HOURS", "24"))
+GC_MAX_FILES_PER_SEC = float(os.getenv("GC_MAX_FILES_PER_SEC", "50"))
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "200"))
+# Upload files are content hashes, so the first two hex digits split the store evenly
+FILE_SHARDS = 256
+
+log = logging.getLogger("retention")
+
+
+def retention_days(role: Optional[str]) -> int:
+    key = f"SCAN_RETENTION_DAYS_{(role or 'user').upper()}"
+    try:
+        return int(os.getenv(key, str(DEFAULT_RETENTION_DAYS)))
+    except ValueError:
+        return DEFAULT_RETENTION_DAYS
+
+
+def shortest_retention_days() -> int:
+    """Smallest non-zero retention over all roles, or 0 when every scan is kept forever.
+
+    Scans younger than this still exist whatever their owner's role, so
+    anything recomputed from `scans` is only complete within this window.
+    """
+    days = [DEFAULT_RETENTION_DAYS]
+    for key, value in os.environ.items():
+        if key.startswith("SCAN_RETENTION_DAYS_"):
+            try:
+                days.append(int(value))
+            except ValueError:
+                pass
+    positive = [d for d in days if d > 0]
+    return min(positive) if positive else 0
+
+
+def expiry_for(role: Optional[str], created_at: datetime) -> Optional[datetime]:
+    days = retention_days(role)
+    if days <= 0:
+        return None
+    return created_at + timedelta(days=days)
+
+
+async def backfill_expiry() -> Dict[str, int]:
+    """Stamp `expire_at` on existing scans that predate the retention policy."""
+    updated = 0
+    async for user in mongodb.db["users"].find({}, {"role": 1}):
+        days = retention_days(user.get("role"))
+        if days <= 0:
+            continue
+        ms = days * 86400 * 1000
+        stage = [{"$set": {"expire_at": {"$add": ["$created_at", ms]}}}]
+        flt = {"user_id": user["_id"], "expire_at": {"$exists": False}}
+        res = await mongodb.db["scans"].update_many(flt, stage)
+        await mongodb.db["scan_payloads"].update_many(flt, stage)
+        updated += res.modified_count
+    return {"updated": updated}
+
+
+async def _references(filename: str) -> int:
+    # Survey photos are scans of their own; surveys only hold references to them
+    return await mongodb.db["scans"].count_documents({"results.image_path": filename})
+
+
+def _mtime(path: Path) -> Optional[float]:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+async def collect_orphans(
+    grace_hours: float = GC_GRACE_HOURS,
+    max_files_per_sec: float = GC_MAX_FILES_PER_SEC,
+    batch_size: int = GC_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """Walk the `blobs` collection in _id order, fix refcounts and delete orphans.
+
+    Each blob's refcount is reset to the number of scans that still
+    refer to its file (TTL deletions never decrement it). A blob nobody refers
+    to is deleted with its file once both its `last_ref_at` and the file's mtime
+    are older than the grace period; uploads that reuse a file refresh both.
+    Progress is kept in `settings.gc_status.cursor`, so an interrupted walk
+    resumes after the last blob it looked at. Returns the run report.
+    """
+    settings = mongodb.db["settings"]
+    blobs = mongodb.db["blobs"]
+    status = await settings.find_one({"_id": "gc_status"}) or {}
+    cursor = status.get("cursor") or ""
+    cutoff = time.time() - grace_hours * 3600
+    cutoff_dt = datetime.utcnow() - timedelta(hours=grace_hours)
+    delay = 1.0 / max_files_per_sec if max_files_per_sec > 0 else 0.0
+
+    report: Dict[str, Any] = {"started_at": datetime.utcnow(), "scanned": 0, "deleted": 0, "reclaimed_bytes": 0, "refcounts_fixed": 0}
+    shard = status.get("file_shard", 0)
+    if cursor == "" and shard < FILE_SHARDS:
+        # Start of a pass: register untracked files, one shard per run
+        report["phase"] = "files"
+        report["file_shard"] = shard
+        report["registered"] = await _register_files(f"{shard:02x}", delay)
+        report["finished_at"] = datetime.utcnow()
+        report["complete_pass"] = False
+        await settings.update_one(
+            {"_id": "gc_status"},
+            {"$set": {"cursor": "", "file_shard": shard + 1, "last_run": report}},
+            upsert=True,
+        )
+        return report
+    report["phase"] = "blobs"
+    batch = await blobs.find({"_id": {"$gt": cursor}}).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+    for blob in batch:
+        report["scanned"] += 1
+        name = blob.get("filename") or ""
+        refs = await _references(name) if name else 0
+        if refs != blob.get("refcount"):
+            # Conditional on the old value so a concurrent upload's $inc is not lost
+            res = await blobs.update_one({"_id": blob["_id"], "refcount": blob.get("refcount")}, {"$set": {"refcount": refs}})
+            report["refcounts_fixed"] += res.modified_count
+        if refs == 0 and (blob.get("last_ref_at") or datetime.min) < cutoff_dt:
+            path = UPLOAD_ROOT / name
+            mtime = _mtime(path) if name else None
+            if mtime is None or mtime < cutoff:
+                res = await blobs.delete_one({"_id": blob["_id"], "refcount": 0, "last_ref_at": blob.get("last_ref_at")})
+                # Re-check right before unlinking: a dedup hit touches the file
+                mtime = _mtime(path) if name else None
+                if res.deleted_count and mtime is not None and mtime < cutoff:
+                    size = path.stat().st_size
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                    else:
+                        report["deleted"] += 1
+                        report["reclaimed_bytes"] += size
+        if delay:
+            await asyncio.sleep(delay)
+
+    # Wrap around once the end of the collection has been reached
+    next_cursor = batch[-1]["_id"] if len(batch) == batch_size else ""
+    report["finished_at"] = datetime.utcnow()
+    report["complete_pass"] = next_cursor == ""
+    await settings.update_one(
+        {"_id": "gc_status"},
+        {
+            "$set": {"cursor": next_cursor, "file_shard": 0 if next_cursor == "" else shard, "last_run": report},
+            "$inc": {"total_deleted": report["deleted"], "total_reclaimed_bytes": report["reclaimed_bytes"]},
+        },
+        upsert=True,
+    )
+    if report["deleted"]:
+        log.info("gc removed %d orphan image(s), %d bytes", report["deleted"], report["reclaimed_bytes"])
+    return report
+
+
+def _list_files(prefix: str) -> List[Tuple[str, int, float]]:
+    files = []
+    for entry in os.scandir(UPLOAD_ROOT):
+        # Dot files are in-progress writes (write_image's temp files)
+        if entry.name.startswith(prefix) and not entry.name.startswith(".") and entry.is_file():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((entry.name, st.st_size, st.st_mtime))
+    return files
+
+
+async def _register_files(prefix: str = "", delay: float = 0.0) -> int:
+    """Create refcount-0 blob documents for upload files starting with ``prefix`` that have none."""
+    if not UPLOAD_ROOT.exists():
+        return 0
+    blobs = mongodb.db["blobs"]
+    files = await asyncio.to_thread(_list_files, prefix)
+    registered = 0
+    for i in range(0, len(files), GC_BATCH_SIZE):
+        chunk = files[i:i + GC_BATCH_SIZE]
+        stems = [os.path.splitext(name)[0] for name, _, _ in chunk]
+        known = {d["_id"] async for d in blobs.find({"_id": {"$in": stems}}, {"_id": 1})}
+        for stem, (name, size, mtime) in zip(stems, chunk):
+            if stem in known:
+                continue
+            res = await blobs.update_one(
+                {"_id": stem},
+                {"$setOnInsert": {
+                    "filename": name,
+                    "size": size,
+                    "refcount": 0,
+                    "created_at": datetime.utcfromtimestamp(mtime),
+                    "last_ref_at": datetime.utcfromtimestamp(mtime),
+                }},
+                upsert=True,
+            )
+            registered += 1 if res.upserted_id is not None else 0
+            if delay:
+                await asyncio.sleep(delay)
+    return registered
+
+
+async def register_untracked_files() -> Dict[str, int]:
+    """Register every upload file without a blob document in one go (the GC does it per shard)."""
+    return {"registered": await _register_files()}
+
+
+async def gc_status() -> Dict[str, Any]:
+    doc = await mongodb.db["settings"].find_one({"_id": "gc_status"}) or {}
+    doc.pop("_id", None)
+    return doc
+
+
+async def run_gc_forever(interval: int = GC_INTERVAL_SECONDS) -> None:
+    while True:
+        try:
+            report = await collect_orphans()
+            # Keep walking without waiting until a full pass over the store is done
+            if not report["complete_pass"]:
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("orphan image collection failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+async def _main(argv: list) -> None:
+    await mongodb.connect()
+    try:
+        if argv[:1] == ["backfill"]:
+            print(await backfill_expiry())
+        elif argv[:1] == ["blobs"]:
+            print(await register_untracked_files())
+        else:
+            print(await collect_orphans())
+    finally:
+        await mongodb.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
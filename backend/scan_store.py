@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import Binary, ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import env  # noqa: F401  (loads .env when run as a script)
+from db import mongodb
+
+try:
+    import zstandard  # type: ignore
+except Exception:
+    zstandard = None  # type: ignore
+
+
+# `scans` holds a compact summary per scan (metadata, risk, title, preview and
+# image references). The heavy parts — raw model output and the full structured
+# JSON — live in `scan_payloads`, keyed by the same _id, and are only read by
+# the detail endpoint.
+PAYLOAD_CODEC = os.getenv("SCAN_PAYLOAD_CODEC", "zstd").lower()
+PAYLOAD_ZSTD_LEVEL = int(os.getenv("SCAN_PAYLOAD_ZSTD_LEVEL", "3"))
+PREVIEW_CHARS = 280
+SEARCH_LIST_LIMIT = 30
+
+HEAVY_FIELDS = ("raw_text", "structured")
+
+
+def _scans():
+    return mongodb.db["scans"]
+
+
+def _payloads():
+    return mongodb.db["scan_payloads"]
+
+
+def risk_level_of(structured: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not isinstance(structured, dict):
+        return None
+    risk = structured.get("risk_level")
+    if not risk and isinstance(structured.get("verdict"), dict):
+        risk = structured["verdict"].get("risk")
+    if not isinstance(risk, str) or not risk.strip():
+        return None
+    return risk.strip().lower()
+
+
+def _preview_text(structured: Optional[Dict[str, Any]], raw_text: Optional[str]) -> Optional[str]:
+    text: Optional[str] = None
+    if isinstance(structured, dict):
+        text = structured.get("summary")
+        if not text and isinstance(structured.get("verdict"), dict):
+            text = structured["verdict"].get("condition")
+    if not text:
+        text = raw_text
+    if not isinstance(text, str) or not text.strip():
+        return None
+    text = text.strip()
+    return text[:PREVIEW_CHARS] + ("…" if len(text) > PREVIEW_CHARS else "")
+
+
+def _str_list(v: Any) -> List[str]:
+    if isinstance(v, str):
+        v = [v]
+    if not isinstance(v, list):
+        return []
+    return [x.strip() for x in v if isinstance(x, str) and x.strip()][:SEARCH_LIST_LIMIT]
+
+
+def search_fields(structured: Optional[Dict[str, Any]], raw_text: Optional[str] = None) -> Dict[str, Any]:
+    """Text copied onto the summary for the ``scans`` text index (see search.py)."""
+    fields: Dict[str, Any] = {}
+    if isinstance(structured, dict):
+        for key in ("title", "summary"):
+            if isinstance(structured.get(key), str) and structured[key].strip():
+                fields[key] = structured[key].strip()
+        if "summary" not in fields and isinstance(structured.get("verdict"), dict):
+            condition = structured["verdict"].get("condition")
+            if isinstance(condition, str) and condition.strip():
+                fields["summary"] = condition.strip()
+        for key in ("findings", "keywords", "highlights"):
+            values = _str_list(structured.get(key))
+            if values:
+                fields[key] = values
+    elif isinstance(raw_text, str) and raw_text.strip():
+        # Unstructured output: index the start of the raw text instead
+        fields["summary"] = raw_text.strip()[:2000]
+    return fields
+
+
+def split_scan(doc: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split a full scan document into its ``scans`` summary and payload body."""
+    summary = {k: v for k, v in doc.items() if k not in HEAVY_FIELDS}
+    structured = doc.get("structured")
+    raw_text = doc.get("raw_text")
+
+    results: List[Dict[str, Any]] = []
+    raws: List[str] = []
+    for r in doc.get("results") or []:
+        r = dict(r or {})
+        raws.append(r.pop("response", "") or "")
+        results.append(r)
+    summary["results"] = results
+
+    if isinstance(structured, dict) and isinstance(structured.get("title"), str):
+        summary["title"] = structured["title"]
+    risk = risk_level_of(structured)
+    if risk:
+        summary["risk_level"] = risk
+    preview = _preview_text(structured, raw_text)
+    if preview:
+        summary["preview"] = preview
+    search = search_fields(structured, raw_text)
+    if search:
+        summary["search"] = search
+    summary["has_payload"] = True
+
+    body: Dict[str, Any] = {"raws": raws}
+    if raw_text is not None:
+        if raw_text in raws:
+            # Usually the (first) image's response: keep a pointer, not a second copy
+            body["raw_text_index"] = raws.index(raw_text)
+        else:
+            body["raw_text"] = raw_text
+    if structured is not None:
+        body["structured"] = structured
+    return summary, body
+
+
+def encode_payload(body: Dict[str, Any]) -> Dict[str, Any]:
+    if PAYLOAD_CODEC == "zstd" and zstandard is not None:
+        raw = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data = zstandard.ZstdCompressor(level=PAYLOAD_ZSTD_LEVEL).compress(raw)
+        return {"codec": "zstd", "data": Binary(data), "size": len(raw)}
+    return {"codec": "none", "body": body}
+
+
+def decode_payload(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not doc:
+        return {}
+    codec = doc.get("codec", "none")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read compressed scan payloads")
+        raw = zstandard.ZstdDecompressor().decompress(bytes(doc["data"]))
+        return json.loads(raw)
+    return doc.get("body") or {}
+
+
+def _raw_text(body: Dict[str, Any]) -> Optional[str]:
+    if "raw_text" in body:
+        return body["raw_text"]
+    raws, index = body.get("raws") or [], body.get("raw_text_index")
+    return raws[index] if isinstance(index, int) and 0 <= index < len(raws) else None
+
+
+def merge_scan(summary: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the full scan document shape from a summary and its payload body."""
+    doc = dict(summary)
+    raws = body.get("raws") or []
+    results: List[Dict[str, Any]] = []
+    for i, r in enumerate(doc.get("results") or []):
+        r = dict(r or {})
+        if "response" not in r:
+            r["response"] = raws[i] if i < len(raws) else ""
+        results.append(r)
+    doc["results"] = results
+    raw_text = _raw_text(body)
+    if raw_text is not None and "raw_text" not in doc:
+        doc["raw_text"] = raw_text
+    for key in HEAVY_FIELDS:
+        if key in body and key not in doc:
+            doc[key] = body[key]
+    doc.pop("has_payload", None)
+    return doc
+
+
+def _payload_doc(scan_id: ObjectId, summary: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+    doc = {
+        "_id": scan_id,
+        "user_id": summary.get("user_id"),
+        "created_at": summary.get("created_at"),
+        **encode_payload(body),
+    }
+    if summary.get("expire_at"):
+        doc["expire_at"] = summary["expire_at"]
+    return doc
+
+
+async def insert_scan(doc: Dict[str, Any]) -> ObjectId:
+    """Persist a full scan document as a summary plus side payload; returns the scan id."""
+    scan_id = doc.get("_id") or ObjectId()
+    summary, body = split_scan({**doc, "_id": scan_id})
+    # Payload first: a summary must never point at a payload that does not exist
+    await _payloads().replace_one({"_id": scan_id}, _payload_doc(scan_id, summary, body), upsert=True)
+    await _scans().insert_one(summary)
+    return scan_id
+
+
+class ScanInsertError(Exception):
+    """Mongo rejected some documents of a batch; the rest of the batch was handled."""
+
+    def __init__(self, inserted: List[ObjectId], rejected: Dict[ObjectId, str]) -> None:
+        super().__init__(f"{len(rejected)} scan(s) rejected: {next(iter(rejected.values()), '')}")
+        self.inserted = inserted
+        self.rejected = rejected
+
+
+async def insert_scans(docs: List[Dict[str, Any]]) -> List[ObjectId]:
+    """Batch variant of :func:`insert_scan`. Documents must carry their ``_id``.
+
+    Returns the ids that were newly inserted: re-inserting an already persisted
+    scan is a no-op, so batches can be replayed. Raises ScanInsertError when
+    Mongo rejects individual summaries for any other reason.
+    """
+    if not docs:
+        return []
+    ops = []
+    summaries: List[Dict[str, Any]] = []
+    for doc in docs:
+        summary, body = split_scan(doc)
+        ops.append(ReplaceOne({"_id": doc["_id"]}, _payload_doc(doc["_id"], summary, body), upsert=True))
+        summaries.append(summary)
+    await _payloads().bulk_write(ops, ordered=False)
+    try:
+        await _scans().insert_many(summaries, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        failed = {err.get("index") for err in errors}
+        inserted = [s["_id"] for i, s in enumerate(summaries) if i not in failed]
+        rejected = {summaries[err["index"]]["_id"]: str(err.get("errmsg") or err.get("code")) for err in errors if err.get("code") != 11000}
+        if rejected:
+            raise ScanInsertError(inserted, rejected) from e
+        return inserted
+    return [s["_id"] for s in summaries]
+
+
+async def load_scan(query: Dict[str, Any], full: bool = True) -> Optional[Dict[str, Any]]:
+    summary = await _scans().find_one(query)
+    if not summary or not full:
+        return summary
+    if not summary.get("has_payload"):
+        # Legacy document that has not been migrated yet
+        return summary
+    body = decode_payload(await _payloads().find_one({"_id": summary["_id"]}))
+    return merge_scan(summary, body)
+
+
+async def migrate(batch_size: int = 200) -> Dict[str, int]:
+    """Move heavy fields of legacy scan documents into ``scan_payloads``."""
+    scans = _scans()
+    query = {"has_payload": {"$ne": True}}
+    migrated = 0
+    async for doc in scans.find(query, batch_size=batch_size):
+        summary, body = split_scan(doc)
+        await _payloads().replace_one({"_id": doc["_id"]}, _payload_doc(doc["_id"], summary, body), upsert=True)
+        await scans.replace_one({"_id": doc["_id"]}, summary)
+        migrated += 1
+    return {"migrated": migrated}
+
+
+async def backfill_search(batch_size: int = 200) -> Dict[str, int]:
+    """Populate ``search`` on summaries written before search existed."""
+    scans = _scans()
+    query = {"has_payload": True, "search": {"$exists": False}}
+    updated = 0
+    async for doc in scans.find(query, {"_id": 1}, batch_size=batch_size):
+        body = decode_payload(await _payloads().find_one({"_id": doc["_id"]}))
+        search = search_fields(body.get("structured"), _raw_text(body))
+        # An empty object marks the scan as processed so reruns skip it
+        await scans.update_one({"_id": doc["_id"]}, {"$set": {"search": search}})
+        updated += 1
+    return {"updated": updated}
+
+
+async def _main(argv: List[str]) -> None:
+    await mongodb.connect()
+    try:
+        print(await migrate())
+        if argv[:1] != ["--no-search"]:
+            print(await backfill_search())
+    finally:
+        await mongodb.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
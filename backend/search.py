@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from bson import ObjectId
+
+from db import mongodb
+
+
+# Scan search runs on the `scans` summaries only. Text matching uses the
+# `search.*` fields copied there by scan_store.split_scan; the text index and
+# the facet indexes are all prefixed with user_id (see db.py), so every query is
+# confined to one user's scans. Pages are keyset-paginated on
+# (created_at desc, _id desc): the cursor is the sort key of the last item seen.
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+FACET_POSTCODES = 20
+
+LIST_PROJECTION = {"raw_text": 0, "results.response": 0, "search": 0}
+
+
+def encode_cursor(created_at: datetime, scan_id: ObjectId) -> str:
+    raw = orjson.dumps([created_at.isoformat(), str(scan_id)])
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+    """Inverse of :func:`encode_cursor`; raises ValueError on a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, scan_id = orjson.loads(raw)
+        return datetime.fromisoformat(created_at), ObjectId(scan_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after_cursor(token: Optional[str]) -> Dict[str, Any]:
+    """Filter selecting documents strictly after ``token`` in (created_at, _id) desc order."""
+    if not token:
+        return {}
+    created_at, scan_id = decode_cursor(token)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": scan_id}},
+    ]}
+
+
+def parse_date(value: Optional[str], end: bool = False) -> Optional[datetime]:
+    """ISO date or datetime; a bare date used as an upper bound covers the whole day."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip())
+    except ValueError as e:
+        raise ValueError(f"Invalid date: {value}") from e
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    if end and len(value.strip()) == 10:
+        dt += timedelta(days=1)
+    return dt
+
+
+def build_query(
+    user_id: ObjectId,
+    q: Optional[str] = None,
+    risk_level: Optional[str] = None,
+    survey_level: Optional[int] = None,
+    postcode: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"user_id": user_id}
+    if q and q.strip():
+        # Mongo text semantics: words are OR-ed, "quoted phrases" must all match
+        query["$text"] = {"$search": q.strip()}
+    if risk_level:
+        query["risk_level"] = risk_level.strip().lower()
+    if survey_level is not None:
+        query["survey.level"] = survey_level
+    if postcode and postcode.strip():
+        query["property.postcode"] = postcode.strip()
+    start, end = parse_date(date_from), parse_date(date_to, end=True)
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    return query
+
+
+async def facet_counts(query: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    pipeline = [
+        {"$match": query},
+        {"$facet": {
+            "risk_level": [{"$group": {"_id": "$risk_level", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}],
+            "survey_level": [{"$group": {"_id": "$survey.level", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+            "postcode": [
+                {"$group": {"_id": "$property.postcode", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": FACET_POSTCODES},
+            ],
+        }},
+    ]
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    async for doc in mongodb.db["scans"].aggregate(pipeline):
+        for name, buckets in doc.items():
+            out[name] = [{"value": b["_id"], "count": b["count"]} for b in buckets if b["_id"] is not None]
+    return out
+
+
+async def search_scans(
+    query: Dict[str, Any],
+    limit: int = SEARCH_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    facets: bool = False,
+) -> Dict[str, Any]:
+    """One page of scan summaries matching ``query`` (from :func:`build_query`)."""
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    page_query = dict(query)
+    keyset = after_cursor(cursor)
+    if keyset:
+        page_query = {"$and": [query, keyset]} if "$or" in query else {**query, **keyset}
+    docs: List[Dict[str, Any]] = []
+    # Fetch one extra row to know whether another page exists
+    find = mongodb.db["scans"].find(page_query, LIST_PROJECTION).sort([("created_at", -1), ("_id", -1)]).limit(limit + 1)
+    async for d in find:
+        docs.append(d)
+    next_cursor: Optional[str] = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last["created_at"], last["_id"])
+    result: Dict[str, Any] = {"docs": docs, "next_cursor": next_cursor}
+    if facets:
+        result["facets"] = await facet_counts(query)
+    return result
@@ -0,0 +1,161 @@
+"""Measure response serialization: stdlib ``JSONResponse`` vs ``ORJSONResponse``.
+
+Usage:
+    python serialization_bench.py [--iterations 500] [--images 6]
+
+Renders two payload shapes both ways: a 50-item ``/api/scans`` history page and
+one large ``rics_single_image`` scan as returned by ``/api/scans/{id}``. The old
+path converts ObjectId/datetime by hand before ``JSONResponse``; the new path
+passes the document straight to ``ORJSONResponse``. Reports median time per
+render and peak allocated bytes (tracemalloc). Nothing touches the database.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+from responses import ORJSONResponse
+
+
+def _history_page(n: int = 50) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "question_id": "rics_single_image",
+            "model": "llava:7b",
+            "images_count": 1,
+            "title": f"Damp patch to rear bedroom ceiling {i}",
+            "risk_level": ("low", "medium", "high")[i % 3],
+            "created_at": now - timedelta(hours=i),
+            "preview_image": f"http://localhost:8000/assets/uploads/{'ab' * 32}.jpg",
+        }
+        for i in range(n)
+    ]
+
+
+def _structured() -> Dict[str, Any]:
+    cost = {"item": "Remove and replace defective plaster", "min": 450, "max": 900, "currency": "GBP"}
+    return {
+        "id": "scan-1",
+        "title": "Rising damp to ground floor party wall",
+        "address": "12 Example Road, Leeds LS6 1AA",
+        "imageUrl": f"http://localhost:8000/assets/uploads/{'cd' * 32}.jpg",
+        "verdict": {"condition": "Condition rating 3: defects that are serious", "risk": "high", "stance": "Negotiate"},
+        "highlights": [f"Tide marks up to {i * 10} cm above skirting" for i in range(8)],
+        "likelyCauses": ["Bridged damp-proof course", "Raised external ground level", "Defective render"],
+        "level1": {
+            "ratings": [{"element": e, "rating": 3, "note": "Further investigation required"} for e in ("Walls", "Floors", "Joinery")],
+            "advice": "Obtain a damp and timber survey from a PCA member before exchange. " * 4,
+        },
+        "level2": {"investigations": ["Moisture readings at 150 mm centres"] * 6, "remediation": ["Reduce external ground level"] * 6},
+        "level3": {"intrusive": ["Expose floor void"] * 4, "risks": ["Timber decay to joist ends"] * 4, "heavyCosts": [cost] * 4},
+        "costs": [cost] * 8,
+        "checklist": [f"Check item {i}" for i in range(20)],
+        "allowance": "Allow for making good and redecoration.",
+    }
+
+
+def _large_scan(images: int) -> Dict[str, Any]:
+    structured = _structured()
+    raw = repr(structured) * 3
+    return {
+        "_id": ObjectId(),
+        "user_id": ObjectId(),
+        "question_id": "rics_single_image",
+        "provider": "ollama",
+        "model": "llava:7b",
+        "created_at": datetime.utcnow(),
+        "title": structured["title"],
+        "risk_level": "high",
+        "results": [
+            {"image_id": f"{i:064x}", "image_path": f"{i:064x}.jpg", "image_url": f"http://localhost:8000/assets/uploads/{i:064x}.jpg", "response": raw}
+            for i in range(images)
+        ],
+        "raw_text": raw,
+        "structured": structured,
+        "usage": {"input_tokens": 1800, "output_tokens": 950, "images": images, "cost_usd": 0.0, "wall_s": 41.2},
+    }
+
+
+def _old_list(items: List[Dict[str, Any]]) -> bytes:
+    out = []
+    for d in items:
+        d = dict(d)
+        d["id"] = str(d.pop("_id"))
+        d["created_at"] = d.get("created_at").isoformat() if d.get("created_at") else None
+        out.append(d)
+    return JSONResponse({"ok": True, "items": out}).body
+
+
+def _new_list(items: List[Dict[str, Any]]) -> bytes:
+    return ORJSONResponse({"ok": True, "items": [{**d, "id": d["_id"]} for d in items]}).body
+
+
+def _old_scan(doc: Dict[str, Any]) -> bytes:
+    d = dict(doc)
+    d["id"] = str(d.pop("_id"))
+    d["user_id"] = str(d.get("user_id"))
+    if d.get("created_at"):
+        d["created_at"] = d["created_at"].isoformat()
+    return JSONResponse({"ok": True, "scan": d}).body
+
+
+def _new_scan(doc: Dict[str, Any]) -> bytes:
+    d = dict(doc)
+    d["id"] = d.pop("_id")
+    return ORJSONResponse({"ok": True, "scan": d}).body
+
+
+def _time(fn: Callable[[], bytes], iterations: int, rounds: int = 5) -> float:
+    """Median microseconds per render over ``rounds`` passes."""
+    per_call: List[float] = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        per_call.append((time.perf_counter() - started) / iterations * 1e6)
+    return statistics.median(per_call)
+
+
+def _peak(fn: Callable[[], bytes]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark JSONResponse vs ORJSONResponse on scan payloads.")
+    ap.add_argument("--iterations", type=int, default=500)
+    ap.add_argument("--images", type=int, default=6, help="photos (raw responses) in the large scan")
+    args = ap.parse_args(argv)
+
+    page = _history_page()
+    scan = _large_scan(args.images)
+    cases = [
+        ("history page (50 items)", lambda: _old_list(page), lambda: _new_list(page)),
+        (f"rics_single_image scan ({args.images} images)", lambda: _old_scan(scan), lambda: _new_scan(scan)),
+    ]
+    print(f"iterations={args.iterations}")
+    for name, old, new in cases:
+        old_us, new_us = _time(old, args.iterations), _time(new, args.iterations)
+        old_peak, new_peak = _peak(old), _peak(new)
+        print(f"{name}: {len(new()) / 1024:.1f} KiB")
+        print(f"  JSONResponse    {old_us:9.1f} us  peak {old_peak / 1024:8.1f} KiB")
+        print(f"  ORJSONResponse  {new_us:9.1f} us  peak {new_peak / 1024:8.1f} KiB  ({old_us / new_us:.1f}x faster)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
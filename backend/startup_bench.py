@@ -0,0 +1,92 @@
+"""Measure backend cold start: time from process launch to the first served request.
+
+Usage:
+    python startup_bench.py [--runs 5] [--ready]
+
+Each run starts ``uvicorn main:app`` on a free port and polls ``/health``
+(liveness) until it answers; with ``--ready`` it also waits for ``/health/ready``
+(Mongo reachable and indexes ensured). Uses the current environment, so point
+MONGODB_URI at the deployment's database to include index creation.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import List, Optional
+
+
+def _redact(uri: str) -> str:
+    """Drop credentials (``user:password@``) from a connection string before printing it."""
+    scheme, sep, rest = uri.partition("://")
+    if not sep:
+        return uri
+    authority, slash, tail = rest.partition("/")
+    if "@" in authority:
+        authority = "***@" + authority.rpartition("@")[2]
+    return f"{scheme}://{authority}{slash}{tail}"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, started: float, timeout: float) -> Optional[float]:
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def run_once(ready: bool, timeout: float) -> dict:
+    port = _free_port()
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=Path(__file__).resolve().parent, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        out = {"first_request_s": _wait_for(f"http://127.0.0.1:{port}/health", started, timeout)}
+        if ready:
+            out["ready_s"] = _wait_for(f"http://127.0.0.1:{port}/health/ready", started, timeout)
+        return out
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark time-to-first-request of the backend.")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--ready", action="store_true", help="also wait for /health/ready")
+    ap.add_argument("--timeout", type=float, default=60)
+    args = ap.parse_args(argv)
+
+    results = [run_once(args.ready, args.timeout) for _ in range(args.runs)]
+    print(f"runs={args.runs} MONGODB_URI={_redact(os.getenv('MONGODB_URI', 'mongodb://localhost:27017'))}")
+    for key in ("first_request_s", "ready_s"):
+        values = [r[key] for r in results if r.get(key) is not None]
+        if key in results[0]:
+            missed = len(results) - len(values)
+            median = f"{statistics.median(values):.3f}s" if values else "n/a"
+            print(f"{key:16} median {median}" + (f"  ({missed} run(s) timed out)" if missed else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from db import mongodb
+
+
+# Content-addressed image store. Files are written once per unique sha256 and
+# shared between scans; the `blobs` collection tracks how many scans refer to
+# each file so duplicates cost a counter increment instead of disk space.
+# Counts only grow here; retention.collect_orphans resets them to the real
+# number of references and removes files nothing refers to.
+UPLOAD_ROOT = Path(os.getenv("IMAGE_UPLOAD_DIR", Path(__file__).resolve().parent / "uploaded_images"))
+UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
+
+ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def _blobs():
+    return mongodb.db["blobs"]
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def normalize_ext(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in ALLOWED_EXTS else ".jpg"
+
+
+def existing_file(digest: str) -> Optional[Path]:
+    # A stat per allowed extension; globbing would list the whole upload directory
+    for ext in sorted(ALLOWED_EXTS):
+        path = UPLOAD_ROOT / f"{digest}{ext}"
+        if path.exists():
+            return path
+    return None
+
+
+def write_image(contents: bytes, filename: Optional[str] = None) -> Dict[str, Any]:
+    """Write image bytes under their content hash without touching Mongo.
+
+    Returns ``{"hash", "filename", "size", "deduplicated"}``. A byte-identical
+    upload reuses the existing file, whatever extension it was first stored with.
+    The caller must take the blob reference (:func:`store_image` does both).
+    """
+    digest = content_hash(contents)
+    existing = existing_file(digest)
+    deduplicated = existing is not None
+    if existing is not None:
+        # Refresh the mtime: the orphan collector spares files used within its grace period
+        os.utime(existing)
+    else:
+        target = UPLOAD_ROOT / f"{digest}{normalize_ext(filename)}"
+        tmp = target.with_name(f".{target.name}.tmp")
+        tmp.write_bytes(contents)
+        os.replace(tmp, target)
+        existing = target
+    return {"hash": digest, "filename": existing.name, "size": len(contents), "deduplicated": deduplicated}
+
+
+async def _add_reference(digest: str, filename: str, size: int, count: int = 1) -> None:
+    now = datetime.utcnow()
+    await _blobs().update_one(
+        {"_id": digest},
+        {
+            "$inc": {"refcount": count},
+            "$set": {"last_ref_at": now},
+            "$setOnInsert": {"filename": filename, "size": size, "created_at": now},
+        },
+        upsert=True,
+    )
+
+
+async def store_image(contents: bytes, filename: Optional[str] = None) -> Dict[str, Any]:
+    """Store image bytes under their content hash and take a reference on the blob."""
+    stored = write_image(contents, filename)
+    await _add_reference(stored["hash"], stored["filename"], stored["size"])
+    return stored
+
+
+async def add_scan_references(doc: Dict[str, Any]) -> None:
+    """Take the blob references of a scan whose images were saved with :func:`write_image`.
+
+    Used by the write-behind flush, so uploads need no Mongo round trip.
+    """
+    counts: Counter = Counter()
+    names: Dict[str, str] = {}
+    for r in doc.get("results") or []:
+        digest, name = r.get("image_hash"), r.get("image_path")
+        if digest and name:
+            counts[digest] += 1
+            names[digest] = name
+    for digest, count in counts.items():
+        try:
+            size = (UPLOAD_ROOT / names[digest]).stat().st_size
+        except OSError:
+            size = 0
+        await _add_reference(digest, names[digest], size, count)
+
+
+async def storage_stats() -> Dict[str, Any]:
+    pipeline = [
+        {
+            "$group": {
+                "_id": None,
+                "blobs": {"$sum": 1},
+                "references": {"$sum": "$refcount"},
+                "stored_bytes": {"$sum": "$size"},
+                "logical_bytes": {"$sum": {"$multiply": ["$size", "$refcount"]}},
+            }
+        }
+    ]
+    agg = await _blobs().aggregate(pipeline).to_list(length=1)
+    row = agg[0] if agg else {}
+    blobs = int(row.get("blobs", 0))
+    references = int(row.get("references", 0))
+    stored = int(row.get("stored_bytes", 0))
+    logical = int(row.get("logical_bytes", 0))
+    return {
+        "blobs": blobs,
+        "references": references,
+        "stored_bytes": stored,
+        "logical_bytes": logical,
+        "saved_bytes": max(logical - stored, 0),
+        "dedup_ratio": round(logical / stored, 3) if stored else 1.0,
+    }
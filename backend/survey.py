@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from db import mongodb
+from scan_store import risk_level_of
+
+
+# Live survey sessions: one `surveys` document per on-site visit. Each analysed
+# photo is stored as its own scan (`survey_id` set) and only a small reference is
+# $push-ed onto the survey as it completes, so the document stays far below
+# Mongo's 16 MB limit. The running property summary is recomputed in memory and
+# $set alongside, so the document is always current.
+SURVEY_WS_CONCURRENCY = int(os.getenv("SURVEY_WS_CONCURRENCY", "3"))
+# Photos received but not yet analysed; the socket is not read beyond this
+SURVEY_WS_MAX_INFLIGHT = int(os.getenv("SURVEY_WS_MAX_INFLIGHT", str(SURVEY_WS_CONCURRENCY * 2)))
+# Must stay below the server's websocket frame limit (uvicorn: 16 MiB unless --ws-max-size)
+SURVEY_MAX_PHOTO_BYTES = int(os.getenv("SURVEY_MAX_PHOTO_BYTES", str(15 * 1024 * 1024)))
+
+_RISK_ORDER = {"low": 1, "moderate": 2, "high": 3}
+
+
+def _surveys():
+    return mongodb.db["surveys"]
+
+
+class SurveySummary:
+    """Running property summary over the photos analysed so far."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None) -> None:
+        data = data or {}
+        self.photos = int(data.get("photos", 0))
+        self.failed = int(data.get("failed", 0))
+        self.risk_counts: Counter = Counter(data.get("risk_counts") or {})
+        self.keywords: Counter = Counter(data.get("keyword_counts") or {})
+        self.titles: List[str] = list(data.get("titles") or [])
+        self.total_tokens = int(data.get("total_tokens", 0))
+        self.cost_usd = float(data.get("cost_usd", 0.0))
+
+    def add(self, photo: Dict[str, Any]) -> None:
+        if photo.get("error"):
+            self.failed += 1
+            return
+        self.photos += 1
+        structured = photo.get("structured") or {}
+        risk = risk_level_of(structured)
+        if risk:
+            self.risk_counts[risk] += 1
+        for kw in (structured.get("keywords") or structured.get("highlights") or [])[:10]:
+            if isinstance(kw, str) and kw.strip():
+                self.keywords[kw.strip().lower()] += 1
+        title = structured.get("title")
+        if isinstance(title, str) and title.strip() and len(self.titles) < 50:
+            self.titles.append(title.strip())
+        usage = photo.get("usage") or {}
+        self.total_tokens += int(usage.get("total_tokens") or 0)
+        self.cost_usd += float(usage.get("cost_usd") or 0.0)
+
+    @property
+    def overall_risk(self) -> Optional[str]:
+        known = [r for r in self.risk_counts if r in _RISK_ORDER]
+        return max(known, key=_RISK_ORDER.__getitem__) if known else None
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {
+            "photos": self.photos,
+            "failed": self.failed,
+            "overall_risk": self.overall_risk,
+            "risk_counts": dict(self.risk_counts),
+            "keyword_counts": dict(self.keywords.most_common(30)),
+            "top_keywords": [k for k, _ in self.keywords.most_common(10)],
+            "titles": self.titles,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+
+async def open_survey(user_id: Optional[str], options: Dict[str, Any], expire_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Create a survey document, or reopen the caller's own survey when ``survey_id`` is given."""
+    uid = ObjectId(user_id) if user_id else None
+    if options.get("survey_id"):
+        if not ObjectId.is_valid(options["survey_id"]):
+            raise ValueError("Invalid survey_id")
+        doc = await _surveys().find_one({"_id": ObjectId(options["survey_id"]), "user_id": uid})
+        if doc:
+            await _surveys().update_one({"_id": doc["_id"]}, {"$set": {"status": "open", "updated_at": datetime.utcnow()}})
+            return doc
+    now = datetime.utcnow()
+    doc: Dict[str, Any] = {
+        "_id": ObjectId(),
+        "user_id": uid,
+        "status": "open",
+        "question_id": options.get("question_id"),
+        "provider": options.get("provider"),
+        "model": options.get("model"),
+        "photos": [],
+        "summary": SurveySummary().to_doc(),
+        "created_at": now,
+        "updated_at": now,
+    }
+    if options.get("property"):
+        doc["property"] = options["property"]
+    if options.get("survey_level") is not None:
+        doc["survey"] = {"level": options["survey_level"]}
+    if expire_at:
+        doc["expire_at"] = expire_at
+    await _surveys().insert_one(doc)
+    return doc
+
+
+def photo_ref(photo: Dict[str, Any]) -> Dict[str, Any]:
+    """What the survey document keeps of a photo; the analysis itself lives in its scan."""
+    ref = {k: photo[k] for k in ("seq", "scan_id", "image_url", "error", "created_at") if photo.get(k) is not None}
+    structured = photo.get("structured") or {}
+    if isinstance(structured.get("title"), str):
+        ref["title"] = structured["title"][:200]
+    risk = risk_level_of(structured)
+    if risk:
+        ref["risk_level"] = risk
+    return ref
+
+
+async def add_photo(survey_id: ObjectId, photo: Dict[str, Any], summary: SurveySummary) -> None:
+    await _surveys().update_one(
+        {"_id": survey_id},
+        {"$push": {"photos": photo_ref(photo)}, "$set": {"summary": summary.to_doc(), "updated_at": datetime.utcnow()}},
+    )
+
+
+async def close_survey(survey_id: ObjectId, summary: SurveySummary) -> None:
+    await _surveys().update_one(
+        {"_id": survey_id},
+        {"$set": {"status": "complete", "summary": summary.to_doc(), "updated_at": datetime.utcnow()}},
+    )
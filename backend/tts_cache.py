@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import UPLOAD_ROOT
+
+
+# On-disk cache of synthesized speech, keyed by everything that changes the
+# audio (text, voice name or id as requested, model and voice settings), plus a registry of
+# in-flight synthesis jobs so the same clip is never generated twice at once.
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", UPLOAD_ROOT.parent / "tts_cache"))
+# Eviction: clips not played for TTS_CACHE_MAX_AGE_DAYS are removed, then the
+# least recently used ones until the directory is under TTS_CACHE_MAX_MB.
+TTS_CACHE_MAX_AGE_DAYS = float(os.getenv("TTS_CACHE_MAX_AGE_DAYS", "30"))
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "512"))
+TTS_CACHE_EVICT_INTERVAL = int(os.getenv("TTS_CACHE_EVICT_INTERVAL", "3600"))
+
+log = logging.getLogger("tts_cache")
+
+
+def cache_key(text: str, voice_id: str, model_id: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    raw = json.dumps([text, voice_id, model_id, settings or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_path(key: str) -> Path:
+    return TTS_CACHE_DIR / f"{key}.mp3"
+
+
+def read_cached(key: str) -> Optional[bytes]:
+    path = cache_path(key)
+    try:
+        audio = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    try:
+        # mtime doubles as last-used time for eviction
+        os.utime(path)
+    except OSError:
+        pass
+    return audio
+
+
+def evict(max_age_days: float = TTS_CACHE_MAX_AGE_DAYS, max_mb: float = TTS_CACHE_MAX_MB) -> Dict[str, int]:
+    """Remove stale clips, then the least recently used ones above the size cap."""
+    report = {"files": 0, "evicted": 0, "freed_bytes": 0}
+    if not TTS_CACHE_DIR.exists():
+        return report
+    cutoff = time.time() - max_age_days * 86400 if max_age_days > 0 else None
+    kept: List[Tuple[float, int, Path]] = []
+    total = 0
+
+    def _remove(path: Path, size: int) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return
+        report["evicted"] += 1
+        report["freed_bytes"] += size
+
+    for entry in os.scandir(TTS_CACHE_DIR):
+        if not entry.is_file() or not entry.name.endswith(".mp3"):
+            continue
+        report["files"] += 1
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        if cutoff is not None and st.st_mtime < cutoff:
+            _remove(Path(entry.path), st.st_size)
+            continue
+        kept.append((st.st_mtime, st.st_size, Path(entry.path)))
+        total += st.st_size
+    limit = int(max_mb * 1024 * 1024)
+    if max_mb > 0 and total > limit:
+        # Down to 90% of the cap so eviction does not run on every write
+        for _, size, path in sorted(kept, key=lambda k: k[0]):
+            if total <= limit * 0.9:
+                break
+            _remove(path, size)
+            total -= size
+    return report
+
+
+async def evict_forever(interval: int = TTS_CACHE_EVICT_INTERVAL) -> None:
+    while True:
+        try:
+            report = await asyncio.to_thread(evict)
+            if report["evicted"]:
+                log.info("tts cache evicted %d clip(s), %d bytes", report["evicted"], report["freed_bytes"])
+        except Exception as e:
+            log.warning("tts cache eviction failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def write_cached(key: str, audio: bytes) -> None:
+    path = cache_path(key)
+    # Created on first write: deployments without TTS never touch the disk
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(audio)
+    os.replace(tmp, path)
+
+
+class TTSJobs:
+    """Deduplicated, cancellable background synthesis jobs keyed by cache key."""
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._owners: Dict[str, Optional[str]] = {}
+
+    def schedule(self, key: str, synthesize: Callable[[], Awaitable[bytes]], owner: Optional[str] = None) -> bool:
+        """Start a job unless the clip is cached or already being made; True if started."""
+        if key in self._jobs or cache_path(key).exists():
+            return False
+
+        async def _run() -> None:
+            try:
+                write_cached(key, await synthesize())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("speculative TTS %s failed: %s", key[:12], e)
+            finally:
+                self._jobs.pop(key, None)
+                self._owners.pop(key, None)
+
+        self._jobs[key] = asyncio.create_task(_run())
+        self._owners[key] = owner
+        return True
+
+    def owner(self, key: str) -> Optional[str]:
+        return self._owners.get(key)
+
+    def pending(self, key: str) -> bool:
+        return key in self._jobs
+
+    async def wait(self, key: str, timeout: float = 60) -> Optional[bytes]:
+        task = self._jobs.get(key)
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                return None
+        return read_cached(key)
+
+    def cancel(self, key: str) -> bool:
+        task = self._jobs.pop(key, None)
+        self._owners.pop(key, None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+
+tts_jobs = TTSJobs()
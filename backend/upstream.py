@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+
+# Shared policy for calls to model and TTS providers:
+#  - read timeouts follow the observed latency of each (service, model, call
+#    shape, e.g. with or without images): once enough samples exist the read
+#    timeout is p99 x UPSTREAM_TIMEOUT_FACTOR, clamped to
+#    [UPSTREAM_MIN_READ_TIMEOUT, the caller's default];
+#  - idempotent calls (GET by default) retry 429/502/503/504, timeouts and
+#    connection errors; POSTs, which are billed once the provider has the body,
+#    only retry failed connects, 429 and 503. Backoff is exponential with full
+#    jitter; Retry-After is honoured, and a wait past the deadline fails the call;
+#  - every call is bounded by the request deadline set by DeadlineMiddleware.
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MIN_READ_TIMEOUT = float(os.getenv("UPSTREAM_MIN_READ_TIMEOUT", "10"))
+UPSTREAM_TIMEOUT_FACTOR = float(os.getenv("UPSTREAM_TIMEOUT_FACTOR", "3"))
+UPSTREAM_MIN_SAMPLES = int(os.getenv("UPSTREAM_MIN_SAMPLES", "20"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "180"))
+
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# The provider did not process the request: safe to resend even when not idempotent
+UNPROCESSED_STATUSES = frozenset({429, 503})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+LATENCY_WINDOW = 200
+
+log = logging.getLogger("upstream")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request deadline passed before the upstream call could complete."""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current request's deadline (None when unbounded)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """Run the block under a deadline ``seconds`` from now, or without one when None."""
+    token = _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class UpstreamStats:
+    """Latency samples per (service, model, shape) and retry/timeout counters per service."""
+
+    def __init__(self) -> None:
+        self._latency: Dict[Tuple[str, str, str], Deque[float]] = {}
+        self.counters: Counter = Counter()
+
+    def observe(self, service: str, model: Optional[str], seconds: float, shape: Optional[str] = None) -> None:
+        key = (service, model or "", shape or "")
+        samples = self._latency.get(key)
+        if samples is None:
+            samples = self._latency[key] = deque(maxlen=LATENCY_WINDOW)
+        samples.append(seconds)
+
+    def count(self, service: str, event: str) -> None:
+        self.counters[f"{service}.{event}"] += 1
+
+    def percentile(self, service: str, model: Optional[str], p: float, shape: Optional[str] = None) -> Optional[float]:
+        samples = self._latency.get((service, model or "", shape or ""))
+        if not samples or len(samples) < UPSTREAM_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def read_timeout(self, service: str, model: Optional[str], default: float, shape: Optional[str] = None) -> float:
+        p99 = self.percentile(service, model, 0.99, shape)
+        if p99 is None:
+            return default
+        return max(UPSTREAM_MIN_READ_TIMEOUT, min(default, p99 * UPSTREAM_TIMEOUT_FACTOR))
+
+    def snapshot(self) -> Dict[str, Any]:
+        latency: Dict[str, Any] = {}
+        for (service, model, shape), samples in self._latency.items():
+            ordered = sorted(samples)
+            pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)  # noqa: E731
+            latency[f"{service}:{model}" + (f":{shape}" if shape else "")] = {"samples": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+        return {"counters": dict(self.counters), "latency": latency}
+
+
+stats = UpstreamStats()
+
+
+def client() -> "httpx.AsyncClient":
+    """New HTTP client; httpx is imported on first use to keep startup fast."""
+    import httpx
+
+    return httpx.AsyncClient()
+
+
+def _timeout(service: str, model: Optional[str], default: float, shape: Optional[str] = None) -> httpx.Timeout:
+    import httpx
+
+    read = stats.read_timeout(service, model, default, shape)
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            stats.count(service, "deadline_exceeded")
+            raise DeadlineExceeded(f"{service}: request deadline exceeded")
+        read = min(read, left)
+    connect = min(UPSTREAM_CONNECT_TIMEOUT, read)
+    return httpx.Timeout(read, connect=connect, pool=connect)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def _sleep_before_retry(service: str, delay: float) -> bool:
+    """Sleep ``delay`` unless that would run past the deadline; False means give up."""
+    left = remaining()
+    if left is not None and delay >= left:
+        return False
+    stats.count(service, "retries")
+    await asyncio.sleep(delay)
+    return True
+
+
+async def request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    service: str,
+    model: Optional[str] = None,
+    shape: Optional[str] = None,
+    default_timeout: float = 120,
+    idempotent: Optional[bool] = None,
+    max_attempts: Optional[int] = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """``client.request`` under the upstream policy; returns the last response.
+
+    ``shape`` separates latency samples of differently sized calls to the same
+    model (e.g. ``"images"`` / ``"text"``). ``idempotent`` defaults to the
+    method's semantics, so a POST is only resent when the provider cannot have
+    processed it. Non-retryable and final error responses are returned, not
+    raised, so callers keep their own status handling. Re-sending requires a
+    re-iterable body (bytes, ``payloads.JSONBody``), never a one-shot generator.
+    """
+    import httpx
+
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    retry_statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+    attempts = max(1, max_attempts or UPSTREAM_MAX_ATTEMPTS)
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        timeout = _timeout(service, model, default_timeout, shape)
+        stats.count(service, "requests")
+        started = time.monotonic()
+        left = remaining()
+        try:
+            call = client.request(method, url, timeout=timeout, **kwargs)
+            # httpx timeouts are per operation; the deadline bounds the whole exchange
+            response = await (call if left is None else asyncio.wait_for(call, left))
+        except asyncio.TimeoutError:
+            stats.count(service, "deadline_exceeded")
+            raise DeadlineExceeded(f"{service}: request deadline exceeded")
+        except httpx.TimeoutException as e:
+            stats.count(service, "timeouts")
+            left = remaining()
+            if left is not None and left <= 0:
+                stats.count(service, "deadline_exceeded")
+                raise DeadlineExceeded(f"{service}: request deadline exceeded")
+            # A read timeout may come after the provider accepted (and billed) the request
+            unsent = isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout))
+            if last or not (idempotent or unsent) or not await _sleep_before_retry(service, _backoff(attempt)):
+                raise
+            continue
+        except httpx.ConnectError:
+            stats.count(service, "connection_errors")
+            if last or not await _sleep_before_retry(service, _backoff(attempt)):
+                raise
+            continue
+        except (httpx.RemoteProtocolError, httpx.ReadError):
+            stats.count(service, "connection_errors")
+            if last or not idempotent or not await _sleep_before_retry(service, _backoff(attempt)):
+                raise
+            continue
+        if response.status_code < 500 and response.status_code != 429:
+            stats.observe(service, model, time.monotonic() - started, shape)
+            return response
+        stats.count(service, f"status_{response.status_code}")
+        if last or response.status_code not in retry_statuses:
+            return response
+        delay = _retry_after(response)
+        delay = _backoff(attempt) if delay is None else delay
+        await response.aclose()
+        log.info("%s returned %s, retrying in %.2fs", service, response.status_code, delay)
+        if not await _sleep_before_retry(service, delay):
+            return response
+    raise AssertionError("unreachable")
+
+
+def _has_body(scope: Dict[str, Any]) -> bool:
+    for name, value in scope.get("headers") or []:
+        if name == b"transfer-encoding":
+            return True
+        if name == b"content-length":
+            return value.strip() not in (b"", b"0")
+    return False
+
+
+class DeadlineMiddleware:
+    """Sets the request deadline and cancels handlers whose client went away.
+
+    The deadline defaults to REQUEST_DEADLINE_SECONDS; a client can shorten it
+    with an ``X-Request-Timeout`` header (seconds). Once the request body has
+    been read, the connection is watched for ``http.disconnect`` and the handler
+    task is cancelled, which aborts any in-flight upstream call.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        seconds = REQUEST_DEADLINE_SECONDS
+        for name, value in scope.get("headers") or []:
+            if name == b"x-request-timeout":
+                try:
+                    seconds = max(0.1, min(seconds, float(value)))
+                except ValueError:
+                    pass
+
+        body_done = asyncio.Event()
+        disconnected = asyncio.Event()
+        pending: List[Dict[str, Any]] = []
+        if not _has_body(scope):
+            # Nothing to wait for: hand the app its empty body and start watching at once
+            pending.append({"type": "http.request", "body": b"", "more_body": False})
+            body_done.set()
+
+        async def app_receive() -> Dict[str, Any]:
+            if pending:
+                return pending.pop()
+            if body_done.is_set():
+                # After the body only a disconnect can arrive; the watcher reads it
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body"):
+                body_done.set()
+            return message
+
+        with deadline_scope(seconds):
+            app_task = asyncio.create_task(self.app(scope, app_receive, send))
+
+        async def watch() -> None:
+            await body_done.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    break
+            disconnected.set()
+            if not app_task.done():
+                stats.count("client", "disconnect_cancelled")
+                app_task.cancel()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                # Cancelled from outside (server shutdown), not by the watcher
+                app_task.cancel()
+                raise
+        finally:
+            watcher.cancel()
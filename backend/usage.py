@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+
+from db import mongodb
+
+
+# Per-scan token / image / timing accounting, rolled up with $inc into one
+# document per user per day (`usage_daily`) and one lifetime document per user
+# (`usage_users`). Budgets are enforced from the daily document, never from scans.
+# Prices in USD per 1M tokens: {"model": [input, output]}; unknown models cost 0.
+_DEFAULT_PRICES = {
+    "gpt-4o-mini": [0.15, 0.60],
+    "gpt-4o": [2.50, 10.00],
+}
+try:
+    MODEL_PRICES: Dict[str, Any] = {**_DEFAULT_PRICES, **json.loads(os.getenv("MODEL_PRICES", "{}"))}
+except ValueError:
+    MODEL_PRICES = dict(_DEFAULT_PRICES)
+
+DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0"))
+
+
+def _ns_to_ms(value: Any) -> Optional[float]:
+    try:
+        return round(int(value) / 1e6, 1)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    price = MODEL_PRICES.get(model)
+    if not price:
+        return 0.0
+    return round((input_tokens * price[0] + output_tokens * price[1]) / 1e6, 6)
+
+
+def normalize_usage(provider: str, model: str, data: Dict[str, Any], wall_ms: float, images: int) -> Dict[str, Any]:
+    """Provider-independent usage record from an OpenAI or Ollama response body."""
+    if (provider or "").lower() == "openai":
+        u = data.get("usage") or {}
+        input_tokens = int(u.get("prompt_tokens") or 0)
+        output_tokens = int(u.get("completion_tokens") or 0)
+        cached = int((u.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        timings: Dict[str, Any] = {}
+    else:
+        input_tokens = int(data.get("prompt_eval_count") or 0)
+        output_tokens = int(data.get("eval_count") or 0)
+        cached = 0
+        timings = {
+            "total_ms": _ns_to_ms(data.get("total_duration")),
+            "load_ms": _ns_to_ms(data.get("load_duration")),
+            "prefill_ms": _ns_to_ms(data.get("prompt_eval_duration")),
+            "generate_ms": _ns_to_ms(data.get("eval_duration")),
+        }
+        timings = {k: v for k, v in timings.items() if v is not None}
+    return {
+        "provider": provider,
+        "model": model,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "cached_tokens": cached,
+        "images": images,
+        "wall_ms": round(wall_ms, 1),
+        "cost_usd": _cost(model, input_tokens, output_tokens),
+        **timings,
+    }
+
+
+def _field(key: Any) -> str:
+    # Model names like "gpt-4.1" must not become dotted field paths
+    return str(key).replace(".", "_").replace("$", "_")
+
+
+def _day(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%d")
+
+
+async def record_usage(user_id: Optional[ObjectId], question_id: str, usage: Optional[Dict[str, Any]], reused: bool = False, now: Optional[datetime] = None) -> None:
+    now = now or datetime.utcnow()
+    usage = usage or {}
+    counters = {
+        "scans": 1,
+        "reused": 1 if reused else 0,
+        "images": int(usage.get("images") or 0),
+        "input_tokens": int(usage.get("input_tokens") or 0),
+        "output_tokens": int(usage.get("output_tokens") or 0),
+        "total_tokens": int(usage.get("total_tokens") or 0),
+        "cached_tokens": int(usage.get("cached_tokens") or 0),
+        "cost_usd": float(usage.get("cost_usd") or 0.0),
+        "model_ms": float(usage.get("total_ms") or usage.get("wall_ms") or 0.0),
+    }
+    inc: Dict[str, Any] = dict(counters)
+    for prefix in (f"by_question.{_field(question_id)}", f"by_model.{_field(usage.get('model') or 'none')}"):
+        for k in ("scans", "total_tokens", "cost_usd", "model_ms"):
+            inc[f"{prefix}.{k}"] = counters[k]
+
+    db = mongodb.db
+    day = _day(now)
+    await db["usage_daily"].update_one(
+        {"_id": f"{user_id}:{day}"},
+        {"$inc": inc, "$setOnInsert": {"user_id": user_id, "day": day}, "$set": {"updated_at": now}},
+        upsert=True,
+    )
+    await db["usage_users"].update_one(
+        {"_id": user_id},
+        {"$inc": counters, "$set": {"updated_at": now}},
+        upsert=True,
+    )
+
+
+def daily_budget(role: Optional[str]) -> int:
+    key = f"USER_DAILY_TOKEN_BUDGET_{(role or 'user').upper()}"
+    try:
+        return int(os.getenv(key, str(DAILY_TOKEN_BUDGET)))
+    except ValueError:
+        return DAILY_TOKEN_BUDGET
+
+
+async def budget_exceeded(user_id: Optional[ObjectId], role: Optional[str]) -> Optional[Dict[str, int]]:
+    """Return ``{"used", "budget"}`` when today's token budget is spent, else None."""
+    budget = daily_budget(role)
+    if budget <= 0:
+        return None
+    doc = await mongodb.db["usage_daily"].find_one({"_id": f"{user_id}:{_day(datetime.utcnow())}"}, {"total_tokens": 1})
+    used = int((doc or {}).get("total_tokens") or 0)
+    if used >= budget:
+        return {"used": used, "budget": budget}
+    return None
+
+
+async def usage_report(user_id: Optional[str] = None, days: int = 30) -> Dict[str, Any]:
+    db = mongodb.db
+    since = _day(datetime.utcnow() - timedelta(days=max(days, 1) - 1))
+    flt: Dict[str, Any] = {"day": {"$gte": since}}
+    if user_id:
+        flt["user_id"] = ObjectId(user_id)
+    daily = await db["usage_daily"].find(flt).sort("day", -1).limit(5000).to_list(length=None)
+    users_flt = {"_id": ObjectId(user_id)} if user_id else {}
+    users = await db["usage_users"].find(users_flt).sort("total_tokens", -1).limit(200).to_list(length=None)
+    return {"daily": daily, "users": users}
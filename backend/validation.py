@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError
+from typing_extensions import Annotated
+
+
+# Per-question models that coerce model output into the documented shape in one
+# pass: missing fields get defaults, scalars become lists, "£1,200" becomes 1200,
+# "Medium" becomes "moderate". Validators are built once at import time.
+def _to_str(v: Any) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, (list, tuple)):
+        return "; ".join(_to_str(x) for x in v if x is not None)
+    if isinstance(v, dict):
+        return "; ".join(f"{k}: {_to_str(x)}" for k, x in v.items())
+    return str(v).strip()
+
+
+def _to_str_list(v: Any) -> List[str]:
+    if v is None:
+        return []
+    if isinstance(v, str):
+        parts = [p.strip(" -•\t") for p in re.split(r"\n+|;\s+", v)]
+        return [p for p in parts if p]
+    if isinstance(v, (list, tuple)):
+        return [s for s in (_to_str(x) for x in v) if s]
+    return [_to_str(v)]
+
+
+_NUM_RE = re.compile(r"(-?\d+(?:\.\d+)?)\s*([kK])?")
+
+
+def _to_num(v: Any) -> float:
+    if isinstance(v, bool):
+        return float(v)
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        m = _NUM_RE.search(v.replace(",", ""))
+        if m:
+            return float(m.group(1)) * (1000 if m.group(2) else 1)
+    return 0.0
+
+
+def _to_risk(v: Any) -> str:
+    s = _to_str(v).lower()
+    if s.startswith(("high", "severe", "serious", "critical")):
+        return "high"
+    if s.startswith(("mod", "medium", "med")):
+        return "moderate"
+    if s.startswith(("low", "minor", "none")):
+        return "low"
+    return s
+
+
+def _to_list(v: Any) -> List[Any]:
+    if v is None:
+        return []
+    if isinstance(v, (list, tuple)):
+        return list(v)
+    return [v]
+
+
+Str = Annotated[str, BeforeValidator(_to_str)]
+StrList = Annotated[List[str], BeforeValidator(_to_str_list)]
+Num = Annotated[float, BeforeValidator(_to_num)]
+Risk = Annotated[str, BeforeValidator(_to_risk)]
+
+
+class _Lenient(BaseModel):
+    # Keep unknown keys so nothing the model returned is lost
+    model_config = ConfigDict(extra="allow")
+
+
+class AnalyzeReport(_Lenient):
+    title: Str = ""
+    summary: Str = ""
+    findings: StrList = Field(default_factory=list)
+    recommended_actions: StrList = Field(default_factory=list)
+    risk_level: Risk = ""
+    keywords: StrList = Field(default_factory=list)
+
+
+class Verdict(_Lenient):
+    condition: Str = ""
+    risk: Risk = ""
+    stance: Str = ""
+
+
+class Rating(_Lenient):
+    element: Str = ""
+    rating: Num = 0
+    note: Str = ""
+
+
+class CostItem(_Lenient):
+    item: Str = ""
+    min: Num = 0
+    max: Num = 0
+
+
+class Level1(_Lenient):
+    ratings: Annotated[List[Rating], BeforeValidator(_to_list)] = Field(default_factory=list)
+    advice: Str = ""
+
+
+class Level2(_Lenient):
+    investigations: StrList = Field(default_factory=list)
+    remediation: StrList = Field(default_factory=list)
+
+
+class Level3(_Lenient):
+    intrusive: StrList = Field(default_factory=list)
+    risks: StrList = Field(default_factory=list)
+    heavyCosts: Annotated[List[CostItem], BeforeValidator(_to_list)] = Field(default_factory=list)
+
+
+def _verdict(v: Any) -> Any:
+    # Some answers give a bare string verdict
+    return {"condition": v} if isinstance(v, str) else v
+
+
+class SingleImageReport(_Lenient):
+    id: Str = ""
+    title: Str = ""
+    address: Str = ""
+    imageUrl: Str = ""
+    verdict: Annotated[Verdict, BeforeValidator(_verdict)] = Field(default_factory=Verdict)
+    highlights: StrList = Field(default_factory=list)
+    likelyCauses: StrList = Field(default_factory=list)
+    level1: Level1 = Field(default_factory=Level1)
+    level2: Level2 = Field(default_factory=Level2)
+    level3: Level3 = Field(default_factory=Level3)
+    costs: Annotated[List[CostItem], BeforeValidator(_to_list)] = Field(default_factory=list)
+    checklist: StrList = Field(default_factory=list)
+    allowance: Str = ""
+
+
+REPORT_MODELS: Dict[str, Type[_Lenient]] = {
+    "rics_analyze": AnalyzeReport,
+    "general": AnalyzeReport,
+    "rics_single_image": SingleImageReport,
+}
+
+# Fields that must carry content for a report to be usable at all
+_CORE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "rics_analyze": ("title", "summary", "findings"),
+    "general": ("title", "summary", "findings"),
+    "rics_single_image": ("title", "verdict", "highlights"),
+}
+
+
+def _has_content(v: Any) -> bool:
+    if isinstance(v, dict):
+        return any(_has_content(x) for x in v.values())
+    if isinstance(v, (list, tuple, str)):
+        return len(v) > 0
+    return v is not None
+
+
+def validate_structured(question_id: str, structured: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Coerce ``structured`` into the question's shape.
+
+    Returns ``(repaired, report)``; ``report["ok"]`` is False when the output is
+    unrecoverable (missing, not an object, or without any core content). Questions
+    without a model in REPORT_MODELS are always ok.
+    """
+    model = REPORT_MODELS.get(question_id)
+    if model is None:
+        # Free-text questions (e.g. rics_offer_text) have no shape to enforce
+        return structured, {"ok": True, "schema": None}
+    if not isinstance(structured, dict):
+        return structured, {"ok": False, "schema": question_id, "errors": ["no JSON object in model output"]}
+    try:
+        repaired = model.model_validate(structured).model_dump()
+    except ValidationError as e:
+        return structured, {"ok": False, "schema": question_id, "errors": [err["msg"] for err in e.errors()[:10]]}
+
+    missing = [k for k in model.model_fields if k not in structured]
+    coerced = [k for k in model.model_fields if k in structured and structured[k] != repaired[k]]
+    core = _CORE_FIELDS.get(question_id, ())
+    ok = any(_has_content(repaired.get(k)) for k in core) if core else True
+    report: Dict[str, Any] = {"ok": ok, "schema": question_id}
+    if missing:
+        report["defaulted"] = missing
+    if coerced:
+        report["coerced"] = coerced
+    if not ok:
+        report["errors"] = [f"none of {', '.join(core)} present"]
+    return repaired, report
+
+
+def reask_prompt(raw_text: Optional[str]) -> str:
+    return (
+        "Convert the following building survey notes into JSON matching the provided schema. "
+        "Use only information present in the notes; leave unknown fields empty.\n\n"
+        + (raw_text or "")[:8000]
+    )
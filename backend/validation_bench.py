@@ -0,0 +1,154 @@
+"""Measure structured-output validation overhead per document.
+
+Usage:
+    python validation_bench.py [--corpus outputs.jsonl] [--mongo 2000] [--budget-ms 1]
+
+The corpus is raw model output: a JSONL file with ``{"question_id", "raw"}`` per
+line, the ``raw_text`` of the latest ``--mongo N`` scans, or (by default) a
+generated set of typical answers — complete, fenced, prose-wrapped, with missing
+fields, scalar lists, "£1,200" costs and bare-string verdicts. Each document is
+extracted once, then ``validate_structured`` is timed. Exits 1 when the mean
+exceeds ``--budget-ms``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from main import _extract_structured_json
+from validation import REPORT_MODELS, validate_structured
+
+
+def _single_image(rng: random.Random) -> Dict[str, Any]:
+    doc: Dict[str, Any] = {
+        "id": "scan",
+        "title": "Damp staining to bedroom ceiling",
+        "address": "12 Example Road",
+        "verdict": {"condition": "Condition rating 2", "risk": rng.choice(["Medium", "high", "Low risk", "moderate"]), "stance": "Proceed with caution"},
+        "highlights": ["Tide marks near chimney breast", "Blown plaster"],
+        "likelyCauses": "Defective flashing; condensation",
+        "level1": {"ratings": [{"element": "Ceilings", "rating": "3", "note": "Stained"}], "advice": "Obtain a roofer's report"},
+        "level2": {"investigations": ["Moisture readings"], "remediation": "Repair flashing"},
+        "level3": {"intrusive": [], "risks": ["Timber decay"], "heavyCosts": [{"item": "Re-roof", "min": "£4,500", "max": "8k"}]},
+        "costs": [{"item": "Make good plaster", "min": "£300", "max": 600}],
+        "checklist": ["Check loft"],
+        "allowance": "£1,000",
+    }
+    for key in rng.sample(sorted(doc), rng.randint(0, 4)):
+        doc.pop(key)
+    if rng.random() < 0.2:
+        doc["verdict"] = "Serious defects"
+    return doc
+
+
+def _analyze(rng: random.Random) -> Dict[str, Any]:
+    doc: Dict[str, Any] = {
+        "title": "Rear elevation",
+        "summary": "Cracking to render with signs of water ingress.",
+        "findings": rng.choice([["Hairline cracks", "Blocked gutter"], "Hairline cracks; Blocked gutter"]),
+        "recommended_actions": ["Clear gutters", "Repair render"],
+        "risk_level": rng.choice(["Medium", "HIGH", "minor"]),
+        "keywords": ["render", "gutter"],
+    }
+    for key in rng.sample(sorted(doc), rng.randint(0, 3)):
+        doc.pop(key)
+    return doc
+
+
+def _wrap(rng: random.Random, obj: Dict[str, Any]) -> str:
+    text = json.dumps(obj, indent=rng.choice([None, 2]))
+    style = rng.random()
+    if style < 0.25:
+        return f"```json\n{text}\n```"
+    if style < 0.4:
+        return f"Here is the assessment:\n{text}\nLet me know if you need more."
+    if style < 0.45:
+        return "I could not assess this image reliably."
+    return text
+
+
+def generated_corpus(n: int, seed: int = 7) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    out: List[Tuple[str, str]] = []
+    for i in range(n):
+        if i % 2:
+            out.append(("rics_single_image", _wrap(rng, _single_image(rng))))
+        else:
+            out.append((rng.choice(["rics_analyze", "general"]), _wrap(rng, _analyze(rng))))
+    return out
+
+
+def file_corpus(path: str) -> List[Tuple[str, str]]:
+    out: List[Tuple[str, str]] = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                row = json.loads(line)
+                out.append((row["question_id"], row.get("raw") or ""))
+    return out
+
+
+async def mongo_corpus(limit: int) -> List[Tuple[str, str]]:
+    from db import mongodb
+    from scan_store import load_scan
+
+    await mongodb.connect()
+    try:
+        out: List[Tuple[str, str]] = []
+        async for s in mongodb.db["scans"].find({"question_id": {"$in": sorted(REPORT_MODELS)}}, {"_id": 1}).sort("created_at", -1).limit(limit):
+            doc = await load_scan({"_id": s["_id"]})
+            if doc and doc.get("raw_text"):
+                out.append((doc["question_id"], doc["raw_text"]))
+        return out
+    finally:
+        await mongodb.disconnect()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark validate_structured over a corpus of model outputs.")
+    ap.add_argument("--corpus", help="JSONL file of {question_id, raw}")
+    ap.add_argument("--mongo", type=int, default=0, help="use the raw_text of the latest N scans")
+    ap.add_argument("--generated", type=int, default=5000, help="size of the generated corpus")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=1.0)
+    args = ap.parse_args(argv)
+
+    if args.corpus:
+        corpus, source = file_corpus(args.corpus), args.corpus
+    elif args.mongo:
+        corpus, source = asyncio.run(mongo_corpus(args.mongo)), f"mongo ({args.mongo} latest scans)"
+    else:
+        corpus, source = generated_corpus(args.generated), "generated"
+    extracted = [(qid, _extract_structured_json(raw)) for qid, raw in corpus]
+    if not extracted:
+        print("empty corpus")
+        return 1
+
+    per_doc: List[float] = []
+    rounds: List[float] = []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        for qid, structured in extracted:
+            t = time.perf_counter()
+            validate_structured(qid, structured)
+            per_doc.append(time.perf_counter() - t)
+        rounds.append((time.perf_counter() - started) / len(extracted))
+    reports = [validate_structured(qid, s)[1] for qid, s in extracted]
+
+    mean_ms = statistics.median(rounds) * 1000
+    ordered = sorted(per_doc)
+    p99_ms = ordered[int(0.99 * (len(ordered) - 1))] * 1000
+    print(f"corpus={source} documents={len(extracted)} ok={sum(r['ok'] for r in reports)} "
+          f"defaulted={sum(bool(r.get('defaulted')) for r in reports)} coerced={sum(bool(r.get('coerced')) for r in reports)}")
+    print(f"validate_structured  mean {mean_ms * 1000:7.1f} us  p99 {p99_ms * 1000:7.1f} us  budget {args.budget_ms:.2f} ms")
+    return 0 if mean_ms <= args.budget_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
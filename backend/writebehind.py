@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from bson import ObjectId, json_util
+from pymongo.errors import ConnectionFailure
+
+from scan_store import ScanInsertError, insert_scans
+
+
+# Optional write-behind persistence for scans. When enabled, scan_image hands the
+# document to the writer and responds immediately with a pre-generated ObjectId.
+# Every pending document is first appended to a local spool file so it survives
+# a crash or a Mongo outage; the spool is replayed on the next startup.
+# At most SCAN_WRITE_MAX_PENDING documents are kept in memory; beyond that they
+# wait in the spool only and are read back as the queue drains. A document Mongo
+# keeps rejecting (not a connection error) is moved to the quarantine file after
+# SCAN_WRITE_MAX_ATTEMPTS tries so it cannot block the scans behind it.
+WRITE_BEHIND_ENABLED = os.getenv("SCAN_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+SPOOL_PATH = Path(os.getenv("SCAN_SPOOL_PATH", Path(__file__).resolve().parent / "spool" / "scans.jsonl"))
+QUARANTINE_PATH = Path(os.getenv("SCAN_QUARANTINE_PATH", SPOOL_PATH.with_name("scans.quarantine.jsonl")))
+BATCH_SIZE = int(os.getenv("SCAN_WRITE_BATCH_SIZE", "50"))
+FLUSH_INTERVAL = float(os.getenv("SCAN_WRITE_FLUSH_INTERVAL", "0.5"))
+MAX_BACKOFF = float(os.getenv("SCAN_WRITE_MAX_BACKOFF", "30"))
+MAX_PENDING = int(os.getenv("SCAN_WRITE_MAX_PENDING", "5000"))
+MAX_ATTEMPTS = int(os.getenv("SCAN_WRITE_MAX_ATTEMPTS", "5"))
+# Bound on best-effort Mongo reads (budget, near-duplicate lookup) on the request path
+REQUEST_READ_TIMEOUT = float(os.getenv("SCAN_WRITE_BEHIND_READ_TIMEOUT", "0.5"))
+
+log = logging.getLogger("writebehind")
+
+T = TypeVar("T")
+
+
+async def best_effort(awaitable: Awaitable[T], default: T) -> T:
+    """Await a Mongo read on the scan request path.
+
+    With write-behind on, the read is bounded by REQUEST_READ_TIMEOUT and any
+    failure yields ``default``, so a Mongo outage does not fail the request.
+    """
+    if not WRITE_BEHIND_ENABLED:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, REQUEST_READ_TIMEOUT)
+    except Exception as e:
+        log.debug("best-effort read skipped: %s", e)
+        return default
+
+
+class ScanWriter:
+    def __init__(
+        self,
+        spool_path: Path,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+        max_attempts: int = MAX_ATTEMPTS,
+        quarantine_path: Optional[Path] = None,
+    ) -> None:
+        self.spool_path = spool_path
+        self.quarantine_path = quarantine_path or spool_path.with_name(spool_path.stem + ".quarantine.jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self.max_attempts = max_attempts
+        self._pending: Dict[ObjectId, Dict[str, Any]] = {}
+        # Documents that are only in the spool file (queue was full)
+        self._spilled = 0
+        self._attempts: Counter = Counter()
+        self._settled: Set[ObjectId] = set()
+        self._hooks: List[Callable[[Dict[str, Any]], Awaitable[None]]] = []
+        self.quarantined = 0
+        self._wakeup = asyncio.Event()
+        self._spool_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._backoff = 0.0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending) + self._spilled
+
+    def pending(self, scan_id: ObjectId) -> Optional[Dict[str, Any]]:
+        return self._pending.get(scan_id)
+
+    def after_insert(self, hook: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Run ``hook(doc)`` once for each newly inserted scan (blob references, accounting).
+
+        Hook errors are logged, not retried.
+        """
+        self._hooks.append(hook)
+
+    async def start(self) -> None:
+        async with self._spool_lock:
+            await self._load_spool()
+        if self._pending:
+            log.info("replaying %d spooled scan(s)", self.pending_count)
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Best effort final flush; whatever is left stays in the spool
+        try:
+            await self.flush()
+        except Exception:
+            pass
+
+    async def submit(self, doc: Dict[str, Any]) -> ObjectId:
+        doc.setdefault("_id", ObjectId())
+        line = json_util.dumps(doc) + "\n"
+        async with self._spool_lock:
+            await asyncio.to_thread(self._append_spool, line)
+            if self._spilled or len(self._pending) >= self.max_pending:
+                # Queue full: the document waits in the spool file only
+                self._spilled += 1
+            else:
+                self._pending[doc["_id"]] = doc
+        if len(self._pending) >= self.batch_size or self._spilled:
+            self._wakeup.set()
+        return doc["_id"]
+
+    async def flush(self) -> int:
+        """Write everything pending once; returns the number of newly inserted scans.
+
+        Connection errors propagate and the queue is retried as a whole later.
+        Documents rejected by Mongo stay queued until they reach ``max_attempts``.
+        """
+        written = 0
+        attempted: Set[ObjectId] = set()
+        while True:
+            if self._spilled and len(self._pending) < self.max_pending:
+                async with self._spool_lock:
+                    await self._load_spool()
+            batch = [d for d in self._pending.values() if d["_id"] not in attempted][: self.batch_size]
+            if not batch:
+                return written
+            attempted.update(d["_id"] for d in batch)
+            written += await self._write(batch)
+            async with self._spool_lock:
+                await self._sync_spool()
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> int:
+        try:
+            inserted = await insert_scans(batch)
+            rejected: Dict[ObjectId, str] = {}
+        except ConnectionFailure:
+            raise
+        except ScanInsertError as e:
+            inserted, rejected = e.inserted, e.rejected
+        except Exception as e:
+            if len(batch) > 1:
+                # Not attributable to one document (e.g. one is too large): isolate it
+                written = 0
+                for doc in batch:
+                    written += await self._write([doc])
+                return written
+            inserted, rejected = [], {batch[0]["_id"]: str(e)}
+        new = set(inserted)
+        for doc in batch:
+            error = rejected.get(doc["_id"])
+            if error is not None:
+                await self._reject(doc, error)
+                continue
+            if doc["_id"] in new:
+                for hook in self._hooks:
+                    try:
+                        await hook(doc)
+                    except Exception as e:
+                        log.warning("after-insert hook %s failed for scan %s: %s", getattr(hook, "__name__", hook), doc["_id"], e)
+            self._settle(doc)
+        return len(new)
+
+    async def _reject(self, doc: Dict[str, Any], error: str) -> None:
+        self._attempts[doc["_id"]] += 1
+        attempts = self._attempts[doc["_id"]]
+        if attempts < self.max_attempts:
+            log.warning("scan %s rejected (attempt %d/%d): %s", doc["_id"], attempts, self.max_attempts, error)
+            return
+        log.error("scan %s quarantined after %d attempts: %s", doc["_id"], attempts, error)
+        entry = {"error": error[:1000], "quarantined_at": datetime.utcnow(), "doc": doc}
+        await asyncio.to_thread(self._append, self.quarantine_path, json_util.dumps(entry) + "\n")
+        self.quarantined += 1
+        self._settle(doc)
+
+    def _settle(self, doc: Dict[str, Any]) -> None:
+        self._pending.pop(doc["_id"], None)
+        self._attempts.pop(doc["_id"], None)
+        self._settled.add(doc["_id"])
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval + self._backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.pending_count:
+                continue
+            try:
+                await self.flush()
+                self._backoff = 0.0 if not self._attempts else max(self._backoff, 1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._backoff = min(max(self._backoff * 2, 1.0), MAX_BACKOFF)
+                log.warning("scan flush failed (%d pending, retry in %.1fs): %s", self.pending_count, self._backoff, e)
+
+    async def _load_spool(self) -> None:
+        """Fill the in-memory queue from the spool (called with the spool lock held)."""
+        docs, total = await asyncio.to_thread(self._read_spool, self.max_pending - len(self._pending), set(self._pending))
+        for doc in docs:
+            self._pending[doc["_id"]] = doc
+        self._spilled = max(0, total - len(self._pending))
+
+    async def _sync_spool(self) -> None:
+        """Drop settled documents from the spool (called with the spool lock held)."""
+        if not self._settled:
+            return
+        if self._spilled:
+            # Part of the queue exists only on disk: filter the file itself
+            await asyncio.to_thread(self._filter_spool, set(self._settled))
+        else:
+            await asyncio.to_thread(self._rewrite_spool, list(self._pending.values()))
+        self._settled.clear()
+
+    def _iter_spool(self):
+        if not self.spool_path.exists():
+            return
+        with self.spool_path.open("r", encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                try:
+                    yield line, json_util.loads(line)
+                except Exception:
+                    # A torn final line from a crash mid-append
+                    log.warning("skipping unreadable spool line")
+
+    def _read_spool(self, limit: int, skip: Set[ObjectId]) -> Tuple[List[Dict[str, Any]], int]:
+        """Up to ``limit`` spooled documents not in ``skip``, plus the spool's document count."""
+        docs: List[Dict[str, Any]] = []
+        total = 0
+        for _, doc in self._iter_spool():
+            total += 1
+            if len(docs) < limit and doc["_id"] not in skip:
+                docs.append(doc)
+        return docs, total
+
+    def _append(self, path: Path, line: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as fh:
+            fh.write(line)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _append_spool(self, line: str) -> None:
+        self._append(self.spool_path, line)
+
+    def _replace_spool(self, lines: Any) -> None:
+        tmp = self.spool_path.with_name(self.spool_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            for line in lines:
+                fh.write(line)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.spool_path)
+
+    def _rewrite_spool(self, docs: List[Dict[str, Any]]) -> None:
+        self._replace_spool(json_util.dumps(doc) + "\n" for doc in docs)
+
+    def _filter_spool(self, settled: Set[ObjectId]) -> None:
+        self._replace_spool(line for line, doc in self._iter_spool() if doc["_id"] not in settled)
+
+
+scan_writer = ScanWriter(SPOOL_PATH, quarantine_path=QUARANTINE_PATH)
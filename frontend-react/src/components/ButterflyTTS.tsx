@@ -60,6 +60,12 @@ export default function ButterflyTTS({ apiBase }: Props) {
       if (!data) return
       const activeUser = getCurrentUserId()
       if (data?.user_id && activeUser && data.user_id !== activeUser) return
+      // The scan response carries a clip the server started synthesizing already
+      const clip = data?.tts?.summary?.url
+      if (clip) {
+        playUrl(`${apiBase}${clip}`)
+        return
+      }
       const summary = data?.raws && Array.isArray(data.raws) ? data.raws[0] : (data?.raw||'')
       // Do not auto-read huge texts
       if (summary) speak(summary.slice(0, 800))